@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import zipfile
+import numpy as np
+from shapely import wkb
+from shapely.errors import ShapelyError
+from shapely.affinity import affine_transform
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dxfmaps")
+SHAPEFILE_EXTENSIONS = (".shp", ".dbf")
+# Normalized coordinates and ratios are rounded to this number of decimals
+# before hashing them, so float noise doesn't change the key
+KEY_DECIMALS = 8
+
+
+def shapefile_stats(path):
+    """Returns a list of (path, size, mtime) tuples for the files of the
+    shapefile given by path. Files that don't exist are skipped.
+    """
+    path = os.path.abspath(path)
+    base, extension = os.path.splitext(path)
+    if extension.lower() not in SHAPEFILE_EXTENSIONS + (".shx",):
+        base = path
+    stats = []
+    for extension in SHAPEFILE_EXTENSIONS:
+        filename = base + extension
+        if os.path.exists(filename):
+            stat = os.stat(filename)
+            stats.append((filename, stat.st_size, stat.st_mtime_ns))
+    return stats
+
+
+def encode_entry(entry):
+    """Splits a cache entry into JSON metadata and a single uint8 array with
+    all its WKB geometries, so it can be stored without pickle. Attributes
+    that JSON can't represent, like dates, are stored as strings.
+    """
+    blobs = []
+    size = 0
+
+    def add(data):
+        nonlocal size
+        blobs.append(data)
+        size += len(data)
+        return [size - len(data), size]
+
+    shapes = [[index] + add(data) for index, data in entry["shapes"].items()]
+    levels = {}
+    for oid, (tolerances, contours) in entry.get("levels", {}).items():
+        spans = [[add(x) for x in level] for level in contours]
+        levels[str(oid)] = [list(tolerances), spans]
+    metadata = {"records": entry["records"], "shapes": shapes, "levels": levels}
+    data = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    return json.dumps(metadata, default=str), data
+
+
+def decode_entry(metadata, data):
+    """Inverse of encode_entry"""
+    metadata = json.loads(metadata)
+    blob = data.tobytes()
+    shapes = {index: blob[start:end] for index, start, end in metadata["shapes"]}
+    levels = {}
+    for oid, (tolerances, spans) in metadata["levels"].items():
+        contours = [[blob[start:end] for start, end in level] for level in spans]
+        levels[int(oid)] = (tuple(tolerances), contours)
+    return {"records": metadata["records"], "shapes": shapes, "levels": levels}
+
+
+class GeometryCache:
+    """
+    Stores the attributes and the decoded geometries of a shapefile on disk,
+    so later maps built from the same file don't need pyshp nor the GeoJSON
+    conversion.
+
+    Geometries are stored as WKB and the attributes as JSON, in a numpy .npz
+    file read without pickle. An entry is keyed by the path, size and
+    modification time of the shapefile, so editing the file invalidates it.
+
+    Attributes:
+        self.directory: folder where the cache files are written
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def key(self, path) -> str:
+        """Returns the key of the cache entry for the given shapefile"""
+        digest = hashlib.sha1()
+        digest.update(repr(shapefile_stats(path)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def filename(self, path) -> str:
+        return os.path.join(self.directory, self.key(path) + ".npz")
+
+    def load(self, path):
+        """Returns the cache entry for the given shapefile, or None if there is
+        no valid entry.
+
+        An entry is a dictionary with the keys "records", a list of
+        dictionaries with the attributes of every record, "shapes", a
+        dictionary mapping record indexes to WKB geometries, and "levels",
+        mapping record indexes to their tolerances and level of detail
+        contours as WKB.
+        """
+        try:
+            with np.load(self.filename(path), allow_pickle=False) as arrays:
+                return decode_entry(str(arrays["metadata"]), arrays["data"])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def store(self, path, entry) -> None:
+        """Writes the cache entry for the given shapefile"""
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(path)
+        temporary = "{}.{}.tmp".format(filename, os.getpid())
+        metadata, data = encode_entry(entry)
+        with open(temporary, "wb") as file:
+            np.savez(file, metadata=np.array(metadata), data=data)
+        os.replace(temporary, filename)
+
+    @staticmethod
+    def dumps(geom) -> bytes:
+        return wkb.dumps(geom)
+
+    @staticmethod
+    def loads(data: bytes):
+        return wkb.loads(data)
+
+
+class LabelCache:
+    """
+    Stores the rectangles where labels are placed, which only depend on the
+    polygon, the ratio of the text and the placement algorithm and its
+    parameters.
+
+    Polygons are moved to (0, 0) and scaled so their longest side is 1 before
+    hashing them, and rectangles are stored in that same frame. A map drawn
+    at another scale or position finds the same entries, and the rectangles
+    are transformed back to its coordinates.
+
+    Attributes:
+        self.directory: folder where the cache files are written, one WKB
+        file per rectangle
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = os.path.join(directory, "labels")
+
+    @staticmethod
+    def normalization(polygon):
+        """Returns the offset and the scale that take the polygon to the
+        normalized frame.
+        """
+        minx, miny, maxx, maxy = polygon.bounds
+        size = max(maxx - minx, maxy - miny)
+        return minx, miny, size or 1.0
+
+    def key(self, polygon, ratio, method, **params) -> str:
+        minx, miny, size = self.normalization(polygon)
+        digest = hashlib.sha1()
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            coords = (np.asarray(ring.coords)[:, :2] - (minx, miny)) / size
+            # Adding 0.0 turns -0.0 into 0.0
+            digest.update((np.round(coords, KEY_DECIMALS) + 0.0).tobytes())
+            digest.update(b"|")
+        parameters = (round(ratio, KEY_DECIMALS), method, sorted(params.items()))
+        digest.update(repr(parameters).encode("utf-8"))
+        return digest.hexdigest()
+
+    def filename(self, key) -> str:
+        return os.path.join(self.directory, key + ".wkb")
+
+    def load(self, polygon, ratio, method, **params):
+        """Returns the cached rectangle for the polygon, in its coordinates,
+        or None.
+        """
+        filename = self.filename(self.key(polygon, ratio, method, **params))
+        try:
+            with open(filename, "rb") as file:
+                rectangle = wkb.loads(file.read())
+        except (OSError, ValueError, ShapelyError):
+            return None
+        minx, miny, size = self.normalization(polygon)
+        return affine_transform(rectangle, [size, 0, 0, size, minx, miny])
+
+    def store(self, polygon, ratio, method, rectangle, **params) -> None:
+        """Writes the rectangle found for the polygon"""
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(self.key(polygon, ratio, method, **params))
+        minx, miny, size = self.normalization(polygon)
+        matrix = [1 / size, 0, 0, 1 / size, -minx / size, -miny / size]
+        rectangle = affine_transform(rectangle, matrix)
+        temporary = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temporary, "wb") as file:
+            file.write(wkb.dumps(rectangle))
+        os.replace(temporary, filename)
+
+
+def get_cache(cache):
+    """Returns a GeometryCache from the value given to Map(cache=...).
+
+    None or False disables the cache, True uses the default directory and a
+    string is taken as the directory of the cache.
+    """
+    if cache is None or cache is False:
+        return None
+    if cache is True:
+        return GeometryCache()
+    if isinstance(cache, GeometryCache):
+        return cache
+    return GeometryCache(cache)
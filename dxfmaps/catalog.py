@@ -0,0 +1,96 @@
+import os
+import shapefile
+from typing import List
+
+
+def normalize(name: str) -> str:
+    """Returns the key used to look up names and continents"""
+    return name.lower()
+
+
+class Catalog:
+    """
+    Attributes of every record of a shapefile, read from the DBF alone.
+    Lookups by name, continent or oid are dictionary lookups and never touch
+    the geometries.
+
+    Attributes:
+        self.fields: names of the fields in the shapefile
+        self.records: list with one dictionary of attributes per record,
+        indexed by oid (the position of the record in the shapefile)
+        self.by_name: normalized name -> list of oids
+        self.by_continent: normalized continent -> list of oids
+    """
+
+    def __init__(self, fields, records, name_field="NAME", continent_field="CONTINENT"):
+        self.fields = list(fields)
+        self.records = [
+            x if isinstance(x, dict) else dict(zip(self.fields, x)) for x in records
+        ]
+        self.name_field = name_field
+        self.continent_field = continent_field
+        self.by_name = {}
+        self.by_continent = {}
+        for oid, record in enumerate(self.records):
+            name = normalize(record[name_field])
+            self.by_name.setdefault(name, []).append(oid)
+            if continent_field in record:
+                continent = normalize(record[continent_field])
+                self.by_continent.setdefault(continent, []).append(oid)
+
+    @classmethod
+    def from_reader(cls, sf, name_field="NAME", continent_field="CONTINENT"):
+        """Builds the catalog from an open shapefile.Reader, reading only its
+        records.
+        """
+        fields = [field[0] for field in sf.fields[1:]]
+        return cls(fields, sf.records(), name_field, continent_field)
+
+    @classmethod
+    def from_path(cls, path, name_field="NAME", continent_field="CONTINENT"):
+        """Builds the catalog opening only the DBF file of the shapefile"""
+        base, extension = os.path.splitext(path)
+        if extension.lower() not in (".shp", ".shx", ".dbf"):
+            base = path
+        with open(base + ".dbf", "rb") as dbf:
+            sf = shapefile.Reader(dbf=dbf)
+            return cls.from_reader(sf, name_field, continent_field)
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, oid: int) -> dict:
+        return self.records[oid]
+
+    def name(self, oid: int) -> str:
+        return normalize(self.records[oid][self.name_field])
+
+    @property
+    def names(self) -> set:
+        return set(self.by_name)
+
+    @property
+    def continents(self) -> set:
+        """Returns the set of continents as written in the shapefile"""
+        return {
+            self.records[oids[0]][self.continent_field]
+            for oids in self.by_continent.values()
+        }
+
+    def oids(self, names) -> List[int]:
+        """Returns the sorted oids of the records matching any of the given
+        names. Names that are not in the catalog are ignored.
+        """
+        oids = []
+        for name in names:
+            oids.extend(self.by_name.get(normalize(name), []))
+        return sorted(oids)
+
+    def continent_oids(self, continent: str) -> List[int]:
+        return self.by_continent.get(normalize(continent), [])
+
+    def countries(self, continent: str) -> set:
+        """Returns the set of normalized names of the countries in the given
+        continent.
+        """
+        return {self.name(oid) for oid in self.continent_oids(continent)}
@@ -0,0 +1,218 @@
+import numpy as np
+from shapely.geometry import Polygon
+from typing import List
+from dxfmaps import projections
+from dxfmaps.country import Country
+from dxfmaps.utils import pack_polygons, affine_coords
+
+
+def ring_areas(coords, ring_offsets):
+    """Returns the unsigned area of every ring, using the shoelace formula
+    over all the rings at once. Rings must be closed.
+    """
+    if len(coords) == 0:
+        return np.zeros(len(ring_offsets) - 1)
+    x, y = coords[:, 0], coords[:, 1]
+    cross = np.zeros(len(coords))
+    cross[:-1] = x[:-1] * y[1:] - x[1:] * y[:-1]
+    # The last vertex of a ring is not joined to the first one of the next
+    cross[ring_offsets[1:] - 1] = 0
+    return np.abs(np.add.reduceat(cross, ring_offsets[:-1])) / 2.0
+
+
+def offsets_from_sizes(sizes):
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return offsets
+
+
+class GeometryStore:
+    """
+    Contours of all the countries of a map in a single contiguous array of
+    coordinates, with offset arrays describing how it is split into rings,
+    polygons and countries (the ragged array layout used by GeoArrow).
+
+    Attributes:
+        self.coords: (n, 2) float64 array with the vertices of every ring
+        self.ring_offsets: ring i spans coords[ring_offsets[i]:ring_offsets[i + 1]]
+        self.polygon_offsets: polygon j spans the rings
+        polygon_offsets[j]:polygon_offsets[j + 1], the first one being its
+        exterior
+        self.country_offsets: country k spans the polygons
+        country_offsets[k]:country_offsets[k + 1]
+        self.names: name of each country
+    """
+
+    def __init__(self, coords, ring_offsets, polygon_offsets, country_offsets, names):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.polygon_offsets = polygon_offsets
+        self.country_offsets = country_offsets
+        self.names = names
+
+    @classmethod
+    def from_countries(cls, countries):
+        chunks = []
+        ring_sizes = []
+        rings_count = []
+        polygons_count = []
+        names = []
+        for country in countries:
+            coords, offsets, count = pack_polygons(country.contours)
+            chunks.append(coords)
+            ring_sizes.append(np.diff(offsets))
+            rings_count.extend(count)
+            polygons_count.append(len(country.contours))
+            names.append(country.name)
+        if chunks:
+            coords = np.concatenate(chunks)
+            ring_sizes = np.concatenate(ring_sizes)
+        else:
+            coords = np.empty((0, 2))
+        return cls(
+            np.ascontiguousarray(coords, dtype=np.float64),
+            offsets_from_sizes(ring_sizes),
+            offsets_from_sizes(rings_count),
+            offsets_from_sizes(polygons_count),
+            names,
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def with_coords(self, coords):
+        """Return a store with the same structure and new coordinates"""
+        return GeometryStore(
+            coords, self.ring_offsets, self.polygon_offsets, self.country_offsets, self.names
+        )
+
+    def project(self, projection, **params):
+        projection = projections.get_projection(projection, **params)
+        return self.with_coords(projection.project(self.coords))
+
+    def affine(self, matrix):
+        return self.with_coords(affine_coords(self.coords, matrix))
+
+    @property
+    def bounds(self):
+        minx, miny = self.coords.min(axis=0).tolist()
+        maxx, maxy = self.coords.max(axis=0).tolist()
+        return minx, miny, maxx, maxy
+
+    @property
+    def exterior_sizes(self):
+        """Number of nodes in the exterior of each polygon"""
+        return np.diff(self.ring_offsets)[self.polygon_offsets[:-1]]
+
+    @property
+    def nodes_count(self) -> int:
+        return int(self.exterior_sizes.sum())
+
+    def polygon_areas(self):
+        """Area of every polygon, its exterior minus its interiors"""
+        areas = ring_areas(self.coords, self.ring_offsets)
+        if len(areas) == 0:
+            return areas
+        exteriors = areas[self.polygon_offsets[:-1]]
+        totals = np.add.reduceat(areas, self.polygon_offsets[:-1])
+        return 2 * exteriors - totals
+
+    def filter_polygons(self, keep):
+        """Return a store with only the polygons where keep is True. Countries
+        left without polygons are removed.
+        """
+        keep = np.asarray(keep, dtype=bool)
+        rings_count = np.diff(self.polygon_offsets)
+        keep_rings = np.repeat(keep, rings_count)
+        ring_sizes = np.diff(self.ring_offsets)
+        keep_coords = np.repeat(keep_rings, ring_sizes)
+        kept_polygons = np.concatenate(([0], np.cumsum(keep)))
+        country_offsets = kept_polygons[self.country_offsets]
+        polygons_count = np.diff(country_offsets)
+        keep_countries = polygons_count > 0
+        names = [x for x, k in zip(self.names, keep_countries) if k]
+        return GeometryStore(
+            self.coords[keep_coords],
+            offsets_from_sizes(ring_sizes[keep_rings]),
+            offsets_from_sizes(rings_count[keep]),
+            offsets_from_sizes(polygons_count[keep_countries]),
+            names,
+        )
+
+    def rings(self, polygon):
+        """Coordinate arrays of the rings of a polygon, exterior first"""
+        start, end = self.polygon_offsets[polygon], self.polygon_offsets[polygon + 1]
+        offsets = self.ring_offsets
+        return [self.coords[offsets[i] : offsets[i + 1]] for i in range(start, end)]
+
+    def polygon(self, polygon) -> Polygon:
+        rings = self.rings(polygon)
+        return Polygon(rings[0], rings[1:])
+
+    def polygon_range(self, country):
+        return range(self.country_offsets[country], self.country_offsets[country + 1])
+
+    def exteriors(self, country=None):
+        """Coordinate arrays of the exteriors of the polygons of a country, or
+        of every polygon in the store.
+        """
+        if country is None:
+            polygons = range(len(self.polygon_offsets) - 1)
+        else:
+            polygons = self.polygon_range(country)
+        starts = self.ring_offsets[self.polygon_offsets[:-1]]
+        ends = self.ring_offsets[self.polygon_offsets[:-1] + 1]
+        return [self.coords[starts[i] : ends[i]] for i in polygons]
+
+    def views(self, labels=None) -> List["CountryView"]:
+        """Return one CountryView per country. labels is an optional list with
+        the labels of each country.
+        """
+        if labels is None:
+            labels = [[] for _ in self.names]
+        return [CountryView(self, i, labels[i]) for i in range(len(self))]
+
+
+class CountryView(Country):
+    """
+    A country whose contours live in a GeometryStore. Shapely polygons are
+    only built when the contours are read, and are not kept.
+    """
+
+    def __init__(self, store: GeometryStore, index: int, labels=[]):
+        self.store = store
+        self.index = index
+        self.name = store.names[index]
+        self.labels = labels
+        self.texts = []
+        self.labels_timed_out = False
+        self.levels = None
+        self._bounds = None
+        self._nodes = None
+        self._areas = None
+
+    @property
+    def contours(self):
+        return [self.store.polygon(i) for i in self.store.polygon_range(self.index)]
+
+    @property
+    def bounds(self):
+        if self._bounds is None:
+            polygons = self.store.polygon_range(self.index)
+            rings = self.store.polygon_offsets[[polygons.start, polygons.stop]]
+            start, end = self.store.ring_offsets[rings]
+            coords = self.store.coords[start:end]
+            minx, miny = coords.min(axis=0).tolist()
+            maxx, maxy = coords.max(axis=0).tolist()
+            self._bounds = (minx, miny, maxx, maxy)
+        return self._bounds
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            sizes = self.store.exterior_sizes[self.store.polygon_range(self.index)]
+            self._nodes = sizes.tolist()
+        return self._nodes
+
+    def exteriors(self):
+        return self.store.exteriors(self.index)
@@ -0,0 +1,290 @@
+"""
+Streaming DXF writer.
+
+The header, tables, blocks and objects sections come from an ezdxf document
+without entities, which is small. The entities are written one by one,
+straight to the file and with the same tags ezdxf 1.x writes, so memory
+doesn't grow with the number of vertices.
+
+Only the ezdxf API available since 0.9 is used: the document is written to
+a string, its entities section is filled in, and $HANDSEED is moved past
+the handles of the new entities.
+"""
+import io
+import math
+import numpy as np
+import ezdxf
+from dxfmaps import utils
+from dxfmaps.text import get_atlas
+
+DXF_VERSION = "R2000"
+# Layers of the maps, name and color
+LAYERS = (("Labels", 7), ("Contours", 1))
+BUFFER_SIZE = 1 << 20
+# Vertices formatted at once
+CHUNK_SIZE = 4096
+
+# How the texts of the labels are written
+POLYLINES = "polylines"  # the outline of every glyph, as the other labels
+BLOCKS = "blocks"  # each glyph defined once as a BLOCK and placed with INSERT
+TEXT = "text"  # TEXT entities, drawn with a font of the CAD program
+TEXT_MODES = (POLYLINES, BLOCKS, TEXT)
+# Relative tolerance to consider a transformation a similarity
+SIMILARITY_TOLERANCE = 1e-9
+
+HANDSEED = "$HANDSEED\n  5\n"
+ENTITIES_START = "  2\nENTITIES\n"
+SECTION_END = "  0\nENDSEC\n"
+
+
+def tag(code, value) -> str:
+    return "{:>3}\n{}\n".format(code, value)
+
+
+def entity_tags(kind, handle, owner, layer, subclass) -> str:
+    """Tags common to every entity"""
+    tags = [
+        tag(0, kind),
+        tag(5, handle),
+        tag(330, owner),
+        tag(100, "AcDbEntity"),
+        tag(8, layer),
+        tag(100, subclass),
+    ]
+    return "".join(tags)
+
+
+def polyline_tags(handle, owner, layer, vertices, chunk=CHUNK_SIZE):
+    """Yields the tags of a LWPOLYLINE with the given (x, y) vertices, as
+    strings of at most chunk vertices.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    yield entity_tags("LWPOLYLINE", handle, owner, layer, "AcDbPolyline")
+    yield tag(90, len(vertices)) + tag(70, 0)
+    for start in range(0, len(vertices), chunk):
+        coords = vertices[start : start + chunk, :2].tolist()
+        yield "".join(" 10\n{!r}\n 20\n{!r}\n".format(x, y) for x, y in coords)
+
+
+def insert_tags(handle, owner, layer, block, x, y, x_scale, y_scale, rotation):
+    """Returns the tags of an INSERT of a block"""
+    tags = [entity_tags("INSERT", handle, owner, layer, "AcDbBlockReference")]
+    tags.append(tag(2, block))
+    tags.append(" 10\n{!r}\n 20\n{!r}\n 30\n0.0\n".format(float(x), float(y)))
+    if x_scale != 1:
+        tags.append(tag(41, repr(float(x_scale))))
+    if y_scale != 1:
+        tags.append(tag(42, repr(float(y_scale))))
+    if rotation != 0:
+        tags.append(tag(50, repr(float(rotation))))
+    return "".join(tags)
+
+
+def text_tags(handle, owner, layer, string, x, y, height, rotation):
+    """Returns the tags of a single line TEXT"""
+    tags = [entity_tags("TEXT", handle, owner, layer, "AcDbText")]
+    tags.append(" 10\n{!r}\n 20\n{!r}\n 30\n0.0\n".format(float(x), float(y)))
+    tags.append(tag(40, repr(float(height))))
+    tags.append(tag(1, string))
+    if rotation != 0:
+        tags.append(tag(50, repr(float(rotation))))
+    tags.append(tag(100, "AcDbText"))
+    return "".join(tags)
+
+
+def similarity(matrix):
+    """Returns the scale, the rotation in degrees and whether the y axis is
+    mirrored of an affine transformation made only of those, or None.
+    """
+    a, b, d, e, _, _ = matrix
+    scale = math.hypot(a, d)
+    tolerance = SIMILARITY_TOLERANCE * scale
+    if scale == 0 or abs(math.hypot(b, e) - scale) > tolerance:
+        return None
+    if abs(a * b + d * e) > tolerance * scale:
+        return None
+    mirrored = a * e - b * d < 0
+    return scale, math.degrees(math.atan2(d, a)), mirrored
+
+
+class DXFWriter:
+    """
+    Writes a DXF file entity by entity. The number of entities must be known
+    when the file is opened, to reserve their handles.
+
+        with DXFWriter("out.dxf", entities=2) as writer:
+            writer.add_polyline(vertices, "Contours")
+            writer.add_polyline(other_vertices, "Labels")
+
+    Attributes:
+        self.filename: path of the file
+        self.entities: number of entities reserved
+        self.document: ezdxf document with everything but the entities.
+        Layers, blocks, etc. can be added to it before opening the writer.
+    """
+
+    def __init__(self, filename, entities, layers=LAYERS, buffer_size=BUFFER_SIZE):
+        self.filename = filename
+        self.entities = entities
+        self.buffer_size = buffer_size
+        self.document = ezdxf.new(DXF_VERSION)
+        for name, color in layers:
+            self.document.layers.new(name=name, dxfattribs={"color": color})
+        self.owner = self.document.modelspace().layout_key
+        self._file = None
+        self._handle = None
+        self._last_handle = None
+        self._tail = None
+        self._blocks = {}
+        self._font_names = {}
+
+    def glyph_block(self, font, char) -> str:
+        """Returns the name of the block with the glyph of a character"""
+        key = id(font) if not isinstance(font, str) else font.upper()
+        font_name = self._font_names.setdefault(
+            key, key if isinstance(key, str) else "FONT{}".format(len(self._font_names))
+        )
+        return "GLYPH_{}_{:X}".format(font_name, ord(char))
+
+    def define_glyph(self, font, char, glyph, layer="Labels") -> str:
+        """Defines a block with the exteriors of the polygons of a glyph,
+        once, and returns its name. Must be called before opening the writer.
+        """
+        name = self.glyph_block(font, char)
+        if name not in self._blocks:
+            block = self.document.blocks.new(name=name)
+            polygons = utils.unpack_polygons(
+                glyph.coords, glyph.offsets, glyph.rings_count
+            )
+            for polygon in polygons:
+                vertices = list(polygon.exterior.coords)
+                block.add_lwpolyline(vertices, dxfattribs={"layer": layer})
+            self._blocks[name] = block
+        return name
+
+    def open(self) -> None:
+        stream = io.StringIO()
+        self.document.write(stream)
+        text = stream.getvalue()
+        # The entities take the handles from $HANDSEED on, and the seed is
+        # moved past them
+        seed = text.index(HANDSEED) + len(HANDSEED)
+        seed_end = text.index("\n", seed)
+        self._handle = int(text[seed:seed_end], 16)
+        self._last_handle = self._handle + self.entities
+        text = text[:seed] + "{:X}".format(self._last_handle) + text[seed_end:]
+        start = text.index(ENTITIES_START) + len(ENTITIES_START)
+        end = text.index(SECTION_END, start)
+        self._file = open(
+            self.filename,
+            "wt",
+            encoding=self.document.encoding,
+            errors="dxfreplace",
+            buffering=self.buffer_size,
+        )
+        self._file.write(text[:end])
+        self._tail = text[end:]
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self._file.write(self._tail)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def next_handle(self) -> str:
+        if self._handle >= self._last_handle:
+            raise ValueError("More than {} entities written".format(self.entities))
+        handle = "{:X}".format(self._handle)
+        self._handle += 1
+        return handle
+
+    def add_polyline(self, vertices, layer) -> None:
+        """Writes a LWPOLYLINE with the given (x, y) vertices"""
+        tags = polyline_tags(self.next_handle(), self.owner, layer, vertices)
+        self._file.writelines(tags)
+
+    def add_insert(self, block, x, y, x_scale, y_scale, rotation, layer) -> None:
+        tags = insert_tags(
+            self.next_handle(), self.owner, layer, block, x, y, x_scale, y_scale, rotation
+        )
+        self._file.write(tags)
+
+    def add_glyph(self, font, char, glyph, x, y, x_scale, y_scale, rotation, layer):
+        """Writes an INSERT of the block of a glyph, see define_glyph"""
+        block = self.glyph_block(font, char)
+        if block not in self._blocks:
+            raise ValueError("Block {} not defined".format(block))
+        self.add_insert(block, x, y, x_scale, y_scale, rotation, layer)
+
+    def add_text(self, string, x, y, height, rotation, layer) -> None:
+        """Writes a TEXT with its baseline starting at x, y"""
+        tags = text_tags(
+            self.next_handle(), self.owner, layer, string, x, y, height, rotation
+        )
+        self._file.write(tags)
+
+
+def label_entities(country, text=POLYLINES):
+    """Yields the entities of the labels of a country as tuples with the
+    name of the DXFWriter method that writes them and its arguments.
+
+    Texts whose transformation is not a similarity are written as polylines.
+    """
+    skip = set()
+    for label in country.texts if text != POLYLINES else []:
+        transform = similarity(label.matrix)
+        if transform is None:
+            continue
+        scale, rotation, mirrored = transform
+        a, _, d, _, xoff, yoff = label.matrix
+        atlas = get_atlas(label.font)
+        positions = atlas.positions(label.string, label.spacing)
+        skip.update(range(label.start, label.end))
+        if text == TEXT and positions:
+            _, glyph, x_offset = positions[0]
+            x = glyph.minx + x_offset
+            height = scale * atlas.glyph("M").coords[:, 1].max()
+            args = (label.string, a * x + xoff, d * x + yoff, height, rotation)
+            yield "add_text", args + ("Labels",)
+            continue
+        y_scale = -scale if mirrored else scale
+        for char, glyph, x_offset in positions:
+            x, y = a * x_offset + xoff, d * x_offset + yoff
+            args = (label.font, char, glyph, x, y, scale, y_scale, rotation)
+            yield "add_glyph", args + ("Labels",)
+    for i, polygon in enumerate(country.labels or []):
+        if i not in skip:
+            yield "add_polyline", (polygon.exterior.coords, "Labels")
+
+
+def write_countries(countries, filename, text=POLYLINES) -> None:
+    """Writes the contours and the labels of the countries.
+
+    :param text: how the texts of the labels are written, one of TEXT_MODES
+    """
+    if text not in TEXT_MODES:
+        raise ValueError("Unknown text mode {}".format(text))
+
+    def entities():
+        for country in countries:
+            for exterior in country.exteriors():
+                yield "add_polyline", (exterior, "Contours")
+            yield from label_entities(country, text)
+
+    writer = DXFWriter(filename, 0)
+    # A first pass counts the entities and defines the glyphs used
+    for method, args in entities():
+        if method == "add_glyph":
+            writer.define_glyph(*args[:3])
+        writer.entities += 1
+    with writer:
+        for method, args in entities():
+            getattr(writer, method)(*args)
@@ -0,0 +1,230 @@
+"""
+Fonts compiled into a binary glyph file, read through a memory map the first
+time a glyph is needed.
+
+File layout, little endian, every section starting at a multiple of 8 bytes:
+
+    header: magic, number of glyphs, polygons, rings and coordinates
+    glyph table: character, first and last polygon, minimum and maximum x
+    polygon offsets: polygon i spans rings polygon_offsets[i]:[i + 1]
+    ring offsets: ring j spans coordinates ring_offsets[j]:[j + 1]
+    coordinates: (n, 2) float64 array
+
+Run "python -m dxfmaps.glyphs" to compile the WKT fonts of dxfmaps.fonts.
+"""
+import os
+from collections import namedtuple
+import numpy as np
+import shapely.wkt
+from dxfmaps import utils
+
+MAGIC = b"DXFGLYF1"
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fontdata")
+EXTENSION = ".glyphs"
+# Fonts compiled from dxfmaps.fonts and shipped with the package
+BUILTIN_FONTS = (
+    "VERA",
+    "OPENSANS_EXTRABOLD",
+    "OPENSANS",
+    "WALKWAY_SEMIBOLD",
+    "WALKWAY_BOLD",
+    "WALKWAY_BLACK",
+)
+
+HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("glyphs", "<u4"),
+        ("polygons", "<u4"),
+        ("rings", "<u4"),
+        ("coords", "<u4"),
+    ]
+)
+GLYPH = np.dtype(
+    [
+        ("char", "<u4"),
+        ("polygon_start", "<u4"),
+        ("polygon_end", "<u4"),
+        ("reserved", "<u4"),
+        ("minx", "<f8"),
+        ("maxx", "<f8"),
+    ]
+)
+
+# A glyph packed as in utils.pack_polygons, with its horizontal bounds
+Glyph = namedtuple("Glyph", ["coords", "offsets", "rings_count", "minx", "maxx"])
+
+
+def _aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+def _sections(glyphs, polygons, rings, coords):
+    """Returns the offset in the file of every section"""
+    offsets = {}
+    position = HEADER.itemsize
+    sizes = (
+        ("glyphs", GLYPH.itemsize * glyphs),
+        ("polygon_offsets", 4 * (polygons + 1)),
+        ("ring_offsets", 4 * (rings + 1)),
+        ("coords", 16 * coords),
+    )
+    for name, size in sizes:
+        position = _aligned(position)
+        offsets[name] = position
+        position += size
+    return offsets
+
+
+def glyph_from_wkt(text) -> Glyph:
+    polygons = utils.get_polygons(shapely.wkt.loads(text))
+    coords, offsets, rings_count = utils.pack_polygons(polygons)
+    minx, maxx = coords[:, 0].min(), coords[:, 0].max()
+    return Glyph(coords, offsets, rings_count, minx, maxx)
+
+
+def write_font(font, path) -> None:
+    """Compiles a font, given as a dictionary mapping characters to WKT
+    geometries, into a binary glyph file.
+    """
+    chars = sorted(font)
+    table = np.zeros(len(chars), dtype=GLYPH)
+    coords = []
+    ring_sizes = []
+    rings_count = []
+    for i, char in enumerate(chars):
+        glyph = glyph_from_wkt(font[char])
+        start, end = len(rings_count), len(rings_count) + len(glyph.rings_count)
+        table[i] = (ord(char), start, end, 0, glyph.minx, glyph.maxx)
+        coords.append(glyph.coords)
+        ring_sizes.append(np.diff(glyph.offsets))
+        rings_count.extend(glyph.rings_count)
+    coords = np.concatenate(coords) if coords else np.empty((0, 2))
+    ring_sizes = np.concatenate(ring_sizes) if ring_sizes else np.empty(0)
+    polygon_offsets = np.zeros(len(rings_count) + 1, dtype="<u4")
+    np.cumsum(rings_count, out=polygon_offsets[1:])
+    ring_offsets = np.zeros(len(ring_sizes) + 1, dtype="<u4")
+    np.cumsum(ring_sizes, out=ring_offsets[1:])
+    header = np.array(
+        [(MAGIC, len(chars), len(rings_count), len(ring_sizes), len(coords))],
+        dtype=HEADER,
+    )
+    sections = _sections(len(chars), len(rings_count), len(ring_sizes), len(coords))
+    arrays = (
+        ("glyphs", table),
+        ("polygon_offsets", polygon_offsets),
+        ("ring_offsets", ring_offsets),
+        ("coords", np.ascontiguousarray(coords, dtype="<f8")),
+    )
+    with open(path, "wb") as file:
+        file.write(header.tobytes())
+        for name, array in arrays:
+            file.write(b"\0" * (sections[name] - file.tell()))
+            file.write(array.tobytes())
+
+
+class FontFile:
+    """
+    A compiled font. The file is only opened, and memory mapped, the first
+    time a glyph is read.
+
+    Attributes:
+        self.path: path of the binary glyph file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._index = None
+
+    def _load(self):
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        header = data[: HEADER.itemsize].view(HEADER)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError("{} is not a glyph file".format(self.path))
+        counts = [int(header[x]) for x in ("glyphs", "polygons", "rings", "coords")]
+        glyphs, polygons, rings, coords = counts
+        sections = _sections(*counts)
+
+        def section(name, dtype, count):
+            start = sections[name]
+            return data[start : start + np.dtype(dtype).itemsize * count].view(dtype)
+
+        self._glyphs = section("glyphs", GLYPH, glyphs)
+        self._polygon_offsets = section("polygon_offsets", "<u4", polygons + 1)
+        self._ring_offsets = section("ring_offsets", "<u4", rings + 1)
+        self._coords = section("coords", "<f8", 2 * coords).reshape(-1, 2)
+        self._index = {chr(x): i for i, x in enumerate(self._glyphs["char"].tolist())}
+        self._data = data
+
+    def __contains__(self, char):
+        if self._index is None:
+            self._load()
+        return char in self._index
+
+    def glyph(self, char):
+        """Returns the Glyph of a character, or None if it's not in the font"""
+        if self._index is None:
+            self._load()
+        i = self._index.get(char)
+        if i is None:
+            return None
+        record = self._glyphs[i]
+        start, end = int(record["polygon_start"]), int(record["polygon_end"])
+        polygon_offsets = self._polygon_offsets[start : end + 1].astype(np.int64)
+        rings = self._ring_offsets[polygon_offsets[0] : polygon_offsets[-1] + 1]
+        rings = rings.astype(np.int64)
+        coords = self._coords[rings[0] : rings[-1]]
+        return Glyph(
+            coords,
+            rings - rings[0],
+            np.diff(polygon_offsets).tolist(),
+            float(record["minx"]),
+            float(record["maxx"]),
+        )
+
+
+_fonts = {}
+
+
+def register_font(name, font) -> None:
+    """Registers a font under a name, so it can be given to Text by name.
+
+    :param name: name of the font
+    :param font: path of a binary glyph file, a FontFile or a dictionary
+        mapping characters to WKT geometries
+    """
+    if isinstance(font, str):
+        font = FontFile(font)
+    _fonts[name.upper()] = font
+
+
+def get_font(name):
+    """Returns the registered font with the given name"""
+    try:
+        return _fonts[name.upper()]
+    except KeyError:
+        raise ValueError("Unknown font {}".format(name))
+
+
+def font_names():
+    return sorted(_fonts)
+
+
+for _name in BUILTIN_FONTS:
+    register_font(_name, os.path.join(FONTS_DIR, _name.lower() + EXTENSION))
+
+
+def compile_builtin_fonts(directory=FONTS_DIR) -> None:
+    """Compiles the WKT fonts of dxfmaps.fonts into directory"""
+    from dxfmaps import fonts
+
+    os.makedirs(directory, exist_ok=True)
+    for name in BUILTIN_FONTS:
+        path = os.path.join(directory, name.lower() + EXTENSION)
+        write_font(getattr(fonts, name), path)
+        print("Written {}".format(path))
+
+
+if __name__ == "__main__":
+    compile_builtin_fonts()
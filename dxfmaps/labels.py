@@ -0,0 +1,135 @@
+import math
+import time
+from collections import defaultdict
+from shapely.prepared import prep
+from dxfmaps.country import label_method
+
+
+class GridIndex:
+    """
+    Uniform grid of square cells, each one with the geometries whose bounds
+    overlap it. Unlike shapely's STRtree, geometries can be added after
+    querying it.
+    """
+
+    def __init__(self, cell):
+        self.cell = cell
+        self.cells = defaultdict(list)
+
+    def _keys(self, bounds):
+        minx, miny, maxx, maxy = bounds
+        x0, x1 = int(math.floor(minx / self.cell)), int(math.floor(maxx / self.cell))
+        y0, y1 = int(math.floor(miny / self.cell)), int(math.floor(maxy / self.cell))
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def insert(self, geom) -> None:
+        for key in self._keys(geom.bounds):
+            self.cells[key].append(geom)
+
+    def query(self, geom):
+        """Returns the geometries whose bounds intersect those of geom"""
+        minx, miny, maxx, maxy = geom.bounds
+        found = {}
+        for key in self._keys(geom.bounds):
+            for other in self.cells.get(key, []):
+                x0, y0, x1, y1 = other.bounds
+                if x0 <= maxx and minx <= x1 and y0 <= maxy and miny <= y1:
+                    found[id(other)] = other
+        return list(found.values())
+
+    def intersects(self, geom) -> bool:
+        return any(geom.intersects(x) for x in self.query(geom))
+
+
+def place_labels(
+    countries,
+    box=False,
+    centroid=False,
+    uppercase=True,
+    n=10,
+    fast=False,
+    method=None,
+    min_text_height=None,
+    cache=None,
+    verbose=True,
+    time_budget=None,
+    deadline=None,
+    refinements=0,
+    max_iterations=None,
+):
+    """
+    Labels all the polygons of a map at once, from the biggest one down.
+
+    A label is dropped when its text doesn't fit inside its polygon, when it
+    overlaps a label already placed, or when the text is smaller than
+    min_text_height. Polygons whose bounds are smaller than min_text_height
+    are skipped without looking for their rectangle.
+
+    :param countries: list of Country objects, their labels are replaced
+    :param min_text_height: minimum height of the text, in the units of the
+        map, or None to keep labels of any size
+    :param cache: optional dxfmaps.cache.LabelCache
+    :param time_budget: seconds to label each country, counted from its
+        first polygon, see Country.generate_labels
+    :param deadline: time.monotonic() value when labeling must stop
+    :param refinements: see Country.generate_labels
+    :param max_iterations: see Country.generate_labels
+    :return: list with the names of the countries that got no label
+    """
+    method = label_method(method, fast)
+    candidates = []
+    for i, country in enumerate(countries):
+        for polygon, area in zip(country.contours, country.areas):
+            if min_text_height is not None:
+                minx, miny, maxx, maxy = polygon.bounds
+                if min(maxx - minx, maxy - miny) < min_text_height:
+                    continue
+            candidates.append((-area, i, polygon))
+    candidates.sort(key=lambda x: x[:2])
+    labels = [[] for _ in countries]
+    texts = [[] for _ in countries]
+    deadlines = {}
+    for country in countries:
+        country.labels_timed_out = False
+    if candidates:
+        # Cells about the size of the average polygon
+        total = -sum(x[0] for x in candidates)
+        index = GridIndex(math.sqrt(total / len(candidates)) or 1.0)
+    for _, i, polygon in candidates:
+        country = countries[i]
+        if i not in deadlines:
+            deadlines[i] = deadline
+            if time_budget is not None:
+                country_deadline = time.monotonic() + time_budget
+                if deadline is None or country_deadline < deadline:
+                    deadlines[i] = country_deadline
+        rectangle, text = country.fit_label(
+            polygon,
+            uppercase,
+            n,
+            method,
+            verbose,
+            cache,
+            deadlines[i],
+            refinements=refinements,
+            max_iterations=max_iterations,
+        )
+        if rectangle is None:
+            continue
+        if min_text_height is not None and text.height < min_text_height:
+            continue
+        footprint = text.footprint
+        if not prep(polygon).covers(footprint) or index.intersects(footprint):
+            continue
+        index.insert(footprint)
+        labels[i].extend(country.label_polygons(rectangle, text, box, centroid))
+        label = country.text_label(text, labels[i])
+        if label is not None:
+            texts[i].append(label)
+    unlabeled = []
+    for country, country_labels, country_texts in zip(countries, labels, texts):
+        country.labels = country_labels
+        country.texts = country_texts
+        if not country_labels:
+            unlabeled.append(country.name)
+    return unlabeled
@@ -1,16 +1,38 @@
+import time
 import shapefile
 import cairocffi as cairo
-import ezdxf
 from shapely import geometry
 from shapely.geometry import Polygon, MultiPolygon
 from typing import List
-from dxfmaps.country import Country
-from .utils import get_polygons, vertical_flip, polygons_to_svg
+from dxfmaps.cache import get_cache, LabelCache
+from dxfmaps.labels import place_labels
+from dxfmaps.catalog import Catalog
+from dxfmaps.dxf import POLYLINES, write_countries
+from dxfmaps.columnar import GeometryStore
+from dxfmaps import projections
+from dxfmaps.country import Country, BUDGET_GROWTH, BUDGET_ITERATIONS
+from dxfmaps.country import MIN_RING_NODES
+from dxfmaps.parallel import map_countries
+from dxfmaps.topology import simplify_countries
+from .utils import get_polygons, polygons_to_svg
+from .utils import IDENTITY, compose, translation, scaling
+from .utils import transform_bounds, affine_polygons
+
+# Tolerances, in degrees, of the default level of detail pyramid
+LOD_TOLERANCES = [0.001 * 2 ** k for k in range(8)]
 
 
 class Map:
     def __init__(
-        self, path, continent=None, countries_set=None, country_field="NAME", units="mm"
+        self,
+        path,
+        continent=None,
+        countries_set=None,
+        country_field="NAME",
+        units="mm",
+        cache=None,
+        columnar=False,
+        lod=False,
     ):
         """
         :param path:
@@ -24,19 +46,132 @@ class Map:
             geometries
         :param units:
             units to use for the output
+        :param cache:
+            directory of an on-disk cache for the decoded geometries and the
+            label placements, True to use the default one or None to disable
+            it
+        :param columnar:
+            keep all the contours in a single array of coordinates (see
+            dxfmaps.columnar) instead of one shapely polygon per contour
+        :param lod:
+            precompute a level of detail pyramid for each country, True for
+            LOD_TOLERANCES or a list of tolerances. Map.simplify then starts
+            from the closest level. Levels are stored in the cache, which is
+            required, so they are only built the first time. They are not
+            used when simplifying with topology=True.
         """
-        sf = shapefile.Reader(path)
-        self.sf = sf
+        self.path = path
+        self._sf = None
+        self.cache = get_cache(cache)
+        if lod and self.cache is None:
+            raise ValueError("Level of detail pyramids require a cache")
+        self._cache_entry = None
+        self._catalog = None
+        if self.cache is not None:
+            self._cache_entry = self.cache.load(path)
         self.units = units
         self.country_field = country_field
-        self.check_shapefile()
         self.continent = continent
         self.countries_set = countries_set
         if countries_set is not None:
             self.countries_set = {x.lower() for x in countries_set}
+        # Translations and scalings are accumulated in this affine
+        # transformation and only applied to the geometries when they are read
+        self._transform = IDENTITY
+        self._raw_bounds = None
+        self._nodes_count = None
+        self.columnar = columnar
+        self._store = None
+        if lod is True:
+            lod = LOD_TOLERANCES
+        self.lod = lod
         self.countries = self.build_countries()
         self.scaling_factor = None
 
+    @property
+    def sf(self):
+        """The shapefile reader. It is only opened when needed, maps loaded
+        from the cache don't use it.
+        """
+        if self._sf is None:
+            self._sf = shapefile.Reader(self.path)
+        return self._sf
+
+    @property
+    def countries(self) -> List[Country]:
+        """The countries in the map. Reading them applies any pending
+        translation or scaling to their geometries.
+        """
+        self._materialize()
+        return self._countries
+
+    @countries.setter
+    def countries(self, countries: List[Country]) -> None:
+        if self.columnar:
+            labels = [country.labels for country in countries]
+            self._set_store(GeometryStore.from_countries(countries), labels)
+            for view, country in zip(self._countries, countries):
+                view.levels = country.levels
+                view.texts = country.texts
+                view.labels_timed_out = country.labels_timed_out
+            return
+        self._countries = countries
+        self._transform = IDENTITY
+        self._raw_bounds = None
+        self._nodes_count = None
+
+    def _set_store(self, store: GeometryStore, labels=None) -> None:
+        """Replaces the contours of a columnar map"""
+        self._store = store
+        self._countries = store.views(labels)
+        self._transform = IDENTITY
+        self._raw_bounds = None
+        self._nodes_count = None
+
+    def _materialize(self) -> None:
+        """Applies the pending affine transformation to the geometries"""
+        if self._transform == IDENTITY:
+            return
+        self._countries = self._transformed_countries(self._transform)
+        if self._raw_bounds is not None:
+            self._raw_bounds = transform_bounds(self._raw_bounds, self._transform)
+        self._transform = IDENTITY
+
+    def _transformed_countries(self, matrix) -> List[Country]:
+        """Return new countries with the affine transformation applied to
+        their contours and labels, transforming all the coordinates in the map
+        as a single block.
+
+        In a columnar map this replaces the store with the transformed one.
+        """
+        if self._store is not None:
+            labels = [affine_polygons(x.labels or [], matrix) for x in self._countries]
+            self._store = self._store.affine(matrix)
+            views = self._store.views(labels)
+            for view, country in zip(views, self._countries):
+                view.texts = [x.transformed(matrix) for x in country.texts]
+            return views
+        contours = []
+        labels = []
+        for country in self._countries:
+            contours.extend(country.contours)
+            labels.extend(country.labels or [])
+        contours = affine_polygons(contours, matrix)
+        labels = affine_polygons(labels, matrix)
+        countries = []
+        contours_start, labels_start = 0, 0
+        for country in self._countries:
+            contours_end = contours_start + len(country.contours)
+            labels_end = labels_start + len(country.labels or [])
+            new_country = country.transformed(
+                contours[contours_start:contours_end],
+                matrix,
+                labels=labels[labels_start:labels_end],
+            )
+            countries.append(new_country)
+            contours_start, labels_start = contours_end, labels_end
+        return countries
+
     @property
     def as_polygons(self) -> List[Polygon]:
         """Return the contours of all countries as a list of shapely polygons
@@ -71,7 +206,21 @@ class Map:
 
         :return: tuple minx, miny, maxx, maxy
         """
-        return self.as_multipolygon.bounds
+        if self._raw_bounds is None and self._store is not None:
+            if len(self._store.coords):
+                self._raw_bounds = self._store.bounds
+        if self._raw_bounds is None:
+            all_bounds = [x.bounds for x in self._countries if x.contours]
+            if not all_bounds:
+                # Bounds of an empty geometry
+                return geometry.MultiPolygon([]).bounds
+            self._raw_bounds = (
+                min(x[0] for x in all_bounds),
+                min(x[1] for x in all_bounds),
+                max(x[2] for x in all_bounds),
+                max(x[3] for x in all_bounds),
+            )
+        return transform_bounds(self._raw_bounds, self._transform)
 
     @property
     def height(self) -> float:
@@ -90,7 +239,11 @@ class Map:
 
         :return: integer: Number of nodes in countries contours
         """
-        return sum([x.nodes_count for x in self.countries])
+        if self._nodes_count is None and self._store is not None:
+            self._nodes_count = self._store.nodes_count
+        if self._nodes_count is None:
+            self._nodes_count = sum([x.nodes_count for x in self._countries])
+        return self._nodes_count
 
     def check_shapefile(self) -> None:
         """Checks if all geometries read from the Shapefile are either Shapely
@@ -99,17 +252,58 @@ class Map:
 
         :return: None
         """
-        for shapeRecord in self.sf.shapeRecords():
-            geom = geometry.shape(shapeRecord.shape.__geo_interface__)
-            is_polygon = isinstance(geom, geometry.polygon.Polygon)
-            is_multipolygon = isinstance(
-                geom, geometry.multipolygon.MultiPolygon
-            )
-            if not (is_polygon or is_multipolygon):
-                print(type(geom))
-                name = shapeRecord.record[self.country_field]
-                msg = "{} is not a valid geometry. It should not be included"
-                raise TypeError(msg.format(name))
+        for oid, record in enumerate(self.catalog.records):
+            self.read_geometry(oid, record[self.country_field])
+
+    @property
+    def catalog(self) -> Catalog:
+        """The attributes of every record in the shapefile, read from the cache
+        when possible or from the DBF otherwise.
+
+        :return: Catalog
+        """
+        if self._catalog is None:
+            if self._cache_entry is not None:
+                records = self._cache_entry["records"]
+                fields = list(records[0]) if records else []
+                self._catalog = Catalog(fields, records, self.country_field)
+            else:
+                self._catalog = Catalog.from_reader(self.sf, self.country_field)
+                if self.cache is not None:
+                    self._cache_entry = {
+                        "records": self._catalog.records,
+                        "shapes": {},
+                        "modified": True,
+                    }
+        return self._catalog
+
+    def read_geometry(self, index: int, name: str):
+        """Decodes the shape stored at the given record index and checks it is
+        either a Shapely Polygon or MultiPolygon. Raises TypeError if it finds
+        a different geometry.
+
+        The shape is read through the .shx offsets, so only this record is
+        decoded.
+
+        :param index: index of the record in the shapefile
+        :param name: name of the country, used in the error message
+        :return: Shapely Polygon or MultiPolygon
+        """
+        if self._cache_entry is not None:
+            cached = self._cache_entry["shapes"].get(index)
+            if cached is not None:
+                return self.cache.loads(cached)
+        geom = geometry.shape(self.sf.shape(index).__geo_interface__)
+        is_polygon = isinstance(geom, geometry.polygon.Polygon)
+        is_multipolygon = isinstance(geom, geometry.multipolygon.MultiPolygon)
+        if not (is_polygon or is_multipolygon):
+            print(type(geom))
+            msg = "{} is not a valid geometry. It should not be included"
+            raise TypeError(msg.format(name))
+        if self._cache_entry is not None:
+            self._cache_entry["shapes"][index] = self.cache.dumps(geom)
+            self._cache_entry["modified"] = True
+        return geom
 
     def build_countries(self) -> List[Country]:
         """Return a list of polygons imported from the shapefile.
@@ -117,9 +311,9 @@ class Map:
         First checks if the user used both conditions, countries and continent,
         to create the map. If so, it raises ValueError.
 
-        Then creates the set of countries if a continent was given.
-
-        Then creates the set of countries if a set of countries was given.
+        The continent or the set of countries are resolved into record indexes
+        with lookups in the catalog. Only the shapes of those records are
+        decoded and validated.
 
         If not set of countries or continent is given, it creates a full map
         of the world.
@@ -128,28 +322,51 @@ class Map:
         """
         if self.countries_set and self.continent:
             raise ValueError("Cannot apply 2 filters.")
-        elif self.continent:
+        catalog = self.catalog
+        if self.continent:
             self.countries_set = self.get_countries(self.continent)
         if self.countries_set:
-            countries = []
-            for shapeRecord in self.sf.shapeRecords():
-                name = shapeRecord.record[self.country_field].lower()
-                if name in self.countries_set:
-                    geom = geometry.shape(shapeRecord.shape.__geo_interface__)
-                    countries.append(Country(get_polygons(geom), name))
+            oids = catalog.oids(self.countries_set)
         else:
-            countries = []
-            names = []
-            for shapeRecord in self.sf.shapeRecords():
-                name = shapeRecord.record[self.country_field].lower()
-                names.append(name)
-                geom = geometry.shape(shapeRecord.shape.__geo_interface__)
-                countries.append(Country(get_polygons(geom), name))
-            self.countries_set = set(names)
+            oids = range(len(catalog))
+            self.countries_set = catalog.names
+        countries = []
+        for oid in oids:
+            name = catalog.name(oid)
+            geom = self.read_geometry(oid, name)
+            country = Country(get_polygons(geom), name)
+            if self.lod:
+                self.read_levels(oid, country)
+            countries.append(country)
+        if self._cache_entry is not None and self._cache_entry.pop("modified", False):
+            self.cache.store(self.path, self._cache_entry)
         if not countries:
             raise ValueError("No countries found")
         return countries
 
+    def read_levels(self, oid: int, country: Country) -> None:
+        """Sets the level of detail pyramid of a country, from the cache when
+        it has one built with the same tolerances, or builds and caches it.
+
+        :param oid: index of the record of the country in the shapefile
+        :param country: Country
+        :return: None
+        """
+        tolerances = tuple(sorted(self.lod))
+        cached = self._cache_entry.setdefault("levels", {}).get(oid)
+        if cached is not None and cached[0] == tolerances:
+            country.levels = []
+            for tolerance, contours in zip(tolerances, cached[1]):
+                contours = [self.cache.loads(x) for x in contours]
+                country.levels.append((tolerance, contours))
+            return
+        country.build_levels(tolerances)
+        levels = []
+        for _, contours in country.levels:
+            levels.append([self.cache.dumps(x) for x in contours])
+        self._cache_entry["levels"][oid] = (tolerances, levels)
+        self._cache_entry["modified"] = True
+
     def get_countries(self, continent: str) -> set:
         """Given a continent, return a set of countries pertaining to it
         according to the shapefile
@@ -157,12 +374,7 @@ class Map:
         :param continent: Name of the continent
         :return: set of Shapely Polygons
         """
-        countries_set = set()
-        for shapeRecord in self.sf.shapeRecords():
-            continent_in_record = shapeRecord.record["CONTINENT"].lower()
-            if continent_in_record == continent:
-                country_name = shapeRecord.record[self.country_field].lower()
-                countries_set.add(country_name)
+        countries_set = self.catalog.countries(continent)
         if len(countries_set) == 0:
             raise ValueError("Continent not found")
         return countries_set
@@ -177,18 +389,44 @@ class Map:
         for country in self.countries:
             count = len(country.contours)
             print("\t{} has {} geometries.".format(country.name, count))
-            p = [x.area for x in country.contours]
+            p = list(country.areas)
             p.sort(reverse=True)
             for x in p:
                 print("\t\t{0:.4f}".format(x))
             # for p in country.contours:
             #     print("\t\t Area {0:.4f}".format(p.area))
 
-    def filter_by_area(self, area_limit=0.5):
+    def filter_by_area(self, area_limit=0.5, workers=None):
+        """Removes the polygons with an area smaller than area_limit, and the
+        countries left without polygons.
+
+        :param area_limit:
+        :param workers: number of processes to use, see dxfmaps.parallel
+        :return: None
+        """
+        if self._store is not None:
+            self._materialize()
+            keep = self._store.polygon_areas() > area_limit
+            store = self._store.filter_polygons(keep)
+            for name in set(self._store.names) - set(store.names):
+                print("{} didn't pass the area filter.".format(name))
+            levels = []
+            for country in self._countries:
+                polygons = self._store.polygon_range(country.index)
+                country_keep = keep[polygons.start : polygons.stop]
+                if country_keep.any():
+                    levels.append(country.filter_levels(country_keep))
+            self._set_store(store)
+            for view, country_levels in zip(self._countries, levels):
+                view.levels = country_levels
+            self.countries_set = set(store.names)
+            return
         new_countries = []
         names = []
-        for country in self.countries:
-            new_country = country.filter_by_area(area_limit)
+        filtered = map_countries(
+            self.countries, "filter_by_area", (area_limit,), workers=workers
+        )
+        for country, new_country in zip(self.countries, filtered):
             if not new_country.contours:
                 print("{} didn't pass the area filter.".format(country.name))
                 continue
@@ -201,15 +439,15 @@ class Map:
         """Prints every field and its values for the item in the specified row
         of the shapefile.
         """
-        fields = [item[0] for item in self.sf.fields[1:]]
-        record = self.sf.record(row)
+        fields = self.catalog.fields
+        record = self.catalog.record(row)
         if field:
-            print("{}: {}".format(fields[field], record[field]))
+            print("{}: {}".format(fields[field], record[fields[field]]))
         else:
             for i, field in enumerate(fields):
                 print("{} - {}: {}".format(i, field, record[field]))
 
-    def project(self, projection_name):
+    def project(self, projection, workers=None, **params):
         """Transforms the current GPS coordinates to the chosen projection
         coordinates.
 
@@ -218,12 +456,33 @@ class Map:
             - Mercator
             - Winkel Tripel
 
-        :param projection_name: Constant from .dxfmaps.utils
+        :param projection: Constant from .dxfmaps.projections, name of a
+            registered projection or a Projection object
+        :param workers: number of processes to project the countries in
+            parallel. By default the whole map is projected at once.
+        :param params: parameters of the projection (lon0, lat0, rf...), only
+            when the projection is given by name
         :return: None
         """
+        if workers is not None and workers > 1:
+            projection = projections.get_projection(projection, **params)
+            self.countries = map_countries(
+                self.countries, "project", (projection,), workers=workers
+            )
+            return
+        # All the contours of the map are projected as a single block of
+        # coordinates and then split back into countries
+        if self._store is not None:
+            self._materialize()
+            self._set_store(self._store.project(projection, **params))
+            return
+        polygons = projections.project_polygons(self.as_polygons, projection, **params)
         new_elements = []
+        start = 0
         for country in self.countries:
-            new_elements.append(country.project(projection_name))
+            end = start + len(country.contours)
+            new_elements.append(Country(polygons[start:end], country.name))
+            start = end
         self.countries = new_elements
 
     def translate_to_center(self) -> None:
@@ -233,10 +492,7 @@ class Map:
         minx, miny, maxx, maxy = self.bounds
         x_offset = -min(minx, maxx)
         y_offset = -min(miny, maxy)
-        new_elements = []
-        for country in self.countries:
-            new_elements.append(country.translate(x_offset, y_offset))
-        self.countries = new_elements
+        self._transform = compose(self._transform, translation(x_offset, y_offset))
 
     def scale_to_width(self, target_width: int) -> None:
         """Scales the geometries to a specific width
@@ -245,10 +501,7 @@ class Map:
         :return:
         """
         self.scaling_factor = target_width / self.width
-        new_elements = []
-        for country in self.countries:
-            new_elements.append(country.scale(self.scaling_factor))
-        self.countries = new_elements
+        self._transform = compose(self._transform, scaling(self.scaling_factor))
 
     def scale(self, scaling_factor) -> None:
         """Scales the geometries to a specific width
@@ -257,30 +510,163 @@ class Map:
         :return:
         """
         self.scaling_factor = scaling_factor
-        new_elements = []
-        for country in self.countries:
-            new_elements.append(country.scale(self.scaling_factor))
-        self.countries = new_elements
+        self._transform = compose(self._transform, scaling(self.scaling_factor))
 
-    def simplify(self, tolerance=0.0002, verbose=True):
+    def simplify(self, tolerance=0.0002, verbose=True, workers=None, topology=False):
         """
         Removes nodes from the path of every polygon according to tolerance
 
         :param tolerance:
         :param verbose:
+        :param workers: number of processes to use, see dxfmaps.parallel
+        :param topology: simplify each border shared by two countries only
+            once, so neighbours keep fitting together (see dxfmaps.topology).
+            workers and the level of detail pyramid are ignored in this mode,
+            the levels are simplified country by country and their borders
+            don't match.
         :return:
         """
-        self.countries = [x.simplify(tolerance) for x in self.countries]
+        if topology:
+            self._warn_lod_topology()
+            self.countries = simplify_countries(self.countries, tolerance)
+        else:
+            self.countries = map_countries(
+                self.countries, "simplify", (tolerance,), workers=workers
+            )
+        if verbose:
+            print("{} nodes.".format(self.nodes_count))
+
+    def _warn_lod_topology(self) -> None:
+        if self.lod:
+            print("Warning: levels of detail are not used with topology=True")
+
+    def simplify_to_output(
+        self, stroke=0.1, resolution=None, node_budget=None, topology=False, verbose=True
+    ):
+        """Simplifies the contours with a tolerance given by the output instead
+        of a fixed number of degrees. It must be called once the map has been
+        projected and scaled to its final size, so coordinates are in the
+        units of the output (self.units).
+
+        :param stroke: width of the line used to draw or cut the contours.
+            Details smaller than half of it are not visible, so that is the
+            tolerance used by default.
+        :param resolution: smallest detail the plotter or laser can
+            reproduce, in the units of the output. Overrides stroke.
+        :param node_budget: maximum number of nodes in the whole map. Every
+            polygon gets the nodes of a triangle, and the rest is split
+            across countries in proportion to the length of their contours.
+            The tolerance of a country grows until it fits in its share.
+        :param topology: simplify shared borders once, see Map.simplify. The
+            node budget is then met growing the tolerance of the whole map,
+            and the level of detail pyramid is not used.
+        :param verbose:
+        :return: None
+        """
+        tolerance = resolution if resolution is not None else stroke / 2.0
+        countries = self.countries
+        if topology:
+            self._warn_lod_topology()
+            self.countries = simplify_countries(countries, tolerance)
+            iterations = 0
+            while node_budget is not None and self.nodes_count > node_budget:
+                if iterations == BUDGET_ITERATIONS:
+                    break
+                tolerance *= BUDGET_GROWTH
+                self.countries = simplify_countries(countries, tolerance)
+                iterations += 1
+        elif node_budget is None:
+            self.countries = [x.simplify(tolerance) for x in countries]
+        else:
+            lengths = [sum(p.length for p in x.contours) for x in countries]
+            total_length = sum(lengths)
+            minimums = [MIN_RING_NODES * len(x.nodes) for x in countries]
+            spare = max(node_budget - sum(minimums), 0)
+            new_countries = []
+            for country, length, minimum in zip(countries, lengths, minimums):
+                budget = minimum
+                if total_length > 0:
+                    budget += int(spare * length / total_length)
+                new_countries.append(country.simplify_to_budget(tolerance, budget))
+            self.countries = new_countries
         if verbose:
             print("{} nodes.".format(self.nodes_count))
 
     def list_of_countries(self):
-        for x in self.sf.shapeRecords():
-            print("Name: {} ({})".format(x.record[self.country_field], x.record.oid))
+        for oid, record in enumerate(self.catalog.records):
+            print("Name: {} ({})".format(record[self.country_field], oid))
+
+    def add_labels(
+        self,
+        box=False,
+        centroid=False,
+        uppercase=True,
+        n=10,
+        fast=False,
+        workers=None,
+        method=None,
+        avoid_collisions=False,
+        min_text_height=None,
+        time_budget=None,
+        map_time_budget=None,
+        refinements=0,
+        max_iterations=None,
+    ):
+        """Generates the labels of every country.
+
+        :param workers: number of processes to label the countries in
+            parallel, see dxfmaps.parallel
+        :param method: algorithm used to place the labels, see
+            Country.generate_labels
+        :param avoid_collisions: place the labels of the whole map at once,
+            from the biggest polygon down, dropping the ones that overlap a
+            label already placed (see dxfmaps.labels.place_labels). Runs in
+            the current process.
+        :param min_text_height: drop the labels with text smaller than this,
+            in the units of the map. Implies avoid_collisions.
+        :param time_budget: seconds to label each country
+        :param map_time_budget: seconds to label the whole map
+        :param refinements: times the mrcd rectangle is refined around the
+            best one found, see Country.generate_labels. Each refinement is
+            several times slower than the previous step.
+        :param max_iterations: maximum number of mrcd steps per polygon
+        :return: None
 
-    def add_labels(self, box=False, centroid=False, uppercase=True, n=10, fast=False):
-        for country in self.countries:
-            country.generate_labels(box, centroid, uppercase, n, fast=fast)
+        Countries that run out of time keep the best label found so far, or
+        the one of the fast method, and are reported at the end.
+
+        If the map has a cache, label rectangles are stored in it, and
+        reused while the contours, the names and the method don't change,
+        even if the map is drawn at another scale.
+        """
+        args = (box, centroid, uppercase, n)
+        kwargs = {
+            "fast": fast,
+            "method": method,
+            "time_budget": time_budget,
+            "refinements": refinements,
+            "max_iterations": max_iterations,
+        }
+        if map_time_budget is not None:
+            kwargs["deadline"] = time.monotonic() + map_time_budget
+        if self.cache is not None:
+            kwargs["cache"] = LabelCache(self.cache.directory)
+        if avoid_collisions or min_text_height is not None:
+            unlabeled = place_labels(
+                self.countries, *args, min_text_height=min_text_height, **kwargs
+            )
+            if unlabeled:
+                print("Countries without label: {}".format(", ".join(unlabeled)))
+        elif workers is not None and workers > 1:
+            self.countries = map_countries(
+                self.countries, "generate_labels", args, kwargs, workers=workers
+            )
+        else:
+            for country in self.countries:
+                country.generate_labels(*args, **kwargs)
+        timed_out = [x.name for x in self.countries if x.labels_timed_out]
+        if timed_out:
+            print("Label deadline reached for: {}".format(", ".join(timed_out)))
 
     def to_png(self, filename="out.png", stroke=1.0, white_bg=True):
         height = int(self.height)
@@ -295,12 +681,22 @@ class Map:
                 context.set_source_rgb(1, 1, 1)
                 context.paint()
         # Cairo coordinate origin is on the upper left corner, so
-        # we need to do a vertical flip first
-        polygons = self.as_polygons
-        polygons.extend(self.labels_as_polygons)
-        polygons = vertical_flip(polygons)
-        for polygon in polygons:
-            vertices = polygon.exterior.coords
+        # we need to do a vertical flip first. It is applied along with any
+        # pending transformation in a single pass.
+        _, miny, _, maxy = self.bounds
+        flip = (1.0, 0.0, 0.0, -1.0, 0.0, miny + maxy)
+        matrix = compose(self._transform, flip)
+        if self._store is not None:
+            rings = self._store.affine(matrix).exteriors()
+            polygons = []
+        else:
+            rings = []
+            polygons = [p for country in self._countries for p in country.contours]
+        for country in self._countries:
+            polygons.extend(country.labels or [])
+        polygons = affine_polygons(polygons, matrix)
+        rings.extend(polygon.exterior.coords for polygon in polygons)
+        for vertices in rings:
             x, y = vertices[0]
             context.move_to(x, y)
             for vertex in vertices:
@@ -309,20 +705,15 @@ class Map:
         context.stroke()
         surface.write_to_png(filename)
 
-    def to_dxf(self, filename="out.dxf"):
-        drawing = ezdxf.new("R2000")
-        modelspace = drawing.modelspace()
-        drawing.layers.new(name="Labels", dxfattribs={"color": 7})
-        drawing.layers.new(name="Contours", dxfattribs={"color": 1})
-        for country in self.countries:
-            for polygon in country.contours:
-                vertices = list(polygon.exterior.coords)
-                modelspace.add_lwpolyline(vertices, dxfattribs={"layer": "Contours"})
-            if country.labels:
-                for polygon in country.labels:
-                    vertices = list(polygon.exterior.coords)
-                    modelspace.add_lwpolyline(vertices, dxfattribs={"layer": "Labels"})
-        drawing.saveas(filename)
+    def to_dxf(self, filename="out.dxf", text=POLYLINES):
+        """Writes the contours and labels, streamed to the file with
+        dxfmaps.dxf.DXFWriter.
+
+        :param text: "polylines" to write the outline of every glyph,
+            "blocks" to define each glyph once as a block and insert it, or
+            "text" for TEXT entities, drawn with a font of the CAD program
+        """
+        write_countries(self.countries, filename, text)
 
     def to_svg(self, filename="out.svg", stroke=0.5, buffered=False, labels=False):
         polygons = []
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+from shapely import wkb
+from dxfmaps.country import Country
+from dxfmaps.text import TextLabel
+
+
+def dump_country(country: Country) -> tuple:
+    """Serializes a country as its name and the WKB of its contours, labels
+    and levels of detail, which is much cheaper to send to another process
+    than pickled objects.
+    """
+    contours = [wkb.dumps(x) for x in country.contours]
+    labels = [wkb.dumps(x) for x in country.labels or []]
+    texts = [tuple(x) for x in country.texts]
+    levels = None
+    if country.levels is not None:
+        levels = [(t, [wkb.dumps(x) for x in c]) for t, c in country.levels]
+    return country.name, contours, labels, texts, country.labels_timed_out, levels
+
+
+def load_country(data: tuple) -> Country:
+    name, contours, labels, texts, timed_out, levels = data
+    contours = [wkb.loads(x) for x in contours]
+    labels = [wkb.loads(x) for x in labels]
+    country = Country(contours, name, labels=labels)
+    country.texts = [TextLabel(*x) for x in texts]
+    country.labels_timed_out = timed_out
+    if levels is not None:
+        country.levels = [(t, [wkb.loads(x) for x in c]) for t, c in levels]
+    return country
+
+
+def _call(task):
+    """Runs a Country method in a worker process. Methods that modify the
+    country in place, like generate_labels, return the modified country.
+    """
+    data, method, args, kwargs = task
+    country = load_country(data)
+    result = getattr(country, method)(*args, **kwargs)
+    if result is None:
+        result = country
+    return dump_country(result)
+
+
+def map_countries(countries, method, args=(), kwargs=None, workers=None):
+    """Calls the given Country method on every country, distributing them
+    across a pool of worker processes. Results are returned in the same
+    order as the countries.
+
+    :param countries: list of Country objects
+    :param method: name of the Country method to call
+    :param args: positional arguments for the method
+    :param kwargs: keyword arguments for the method
+    :param workers: number of processes. None or 1 runs everything in the
+        current process.
+    :return: list with the Country returned by each call, or the country
+        itself when the method returns None
+    """
+    kwargs = kwargs or {}
+    if workers is None or workers <= 1:
+        results = []
+        for country in countries:
+            result = getattr(country, method)(*args, **kwargs)
+            results.append(country if result is None else result)
+        return results
+    tasks = [(dump_country(x), method, args, kwargs) for x in countries]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_call, tasks)
+        return [load_country(x) for x in results]
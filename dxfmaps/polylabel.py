@@ -0,0 +1,125 @@
+import math
+import numpy as np
+from shapely.geometry import Polygon, box
+from shapely.prepared import prep
+from typing import Optional
+from dxfmaps.raster import points_chunk, polygon_edges, points_in_polygon
+
+# Default precision of the pole of inaccessibility, relative to the shortest
+# side of the bounds of the polygon
+DEFAULT_PRECISION = 0.01
+
+
+def signed_distances(polygon: Polygon, xs, ys, chunk=None):
+    """Returns the distance from every point to the boundary of the polygon,
+    negative for the points outside. Points are evaluated in chunks, see
+    dxfmaps.raster.points_chunk.
+    """
+    xs = np.asarray(xs, dtype=float).ravel()
+    ys = np.asarray(ys, dtype=float).ravel()
+    x0, y0, x1, y1 = polygon_edges(polygon)
+    dx, dy = x1 - x0, y1 - y0
+    lengths = dx * dx + dy * dy
+    lengths[lengths == 0] = 1.0
+    chunk = points_chunk(len(x0), chunk)
+    distances = np.empty(len(xs))
+    for start in range(0, len(xs), chunk):
+        px = xs[start : start + chunk, None]
+        py = ys[start : start + chunk, None]
+        # Closest point of every edge
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / lengths, 0.0, 1.0)
+        squared = (x0 + t * dx - px) ** 2 + (y0 + t * dy - py) ** 2
+        distances[start : start + chunk] = np.sqrt(squared.min(axis=1))
+    inside = points_in_polygon(polygon, xs, ys)
+    return np.where(inside, distances, -distances)
+
+
+def pole_of_inaccessibility(polygon: Polygon, precision=None):
+    """
+    Returns the point inside the polygon farthest from its boundary, with
+    the quadtree search of polylabel, and its distance to the boundary.
+
+    The bounds of the polygon are split into square cells. Every cell that
+    may contain a point farther than the best one found so far, by more than
+    precision, is split into four. All the cells of the same size are
+    evaluated at once.
+
+    :param polygon: shapely Polygon
+    :param precision: the distance found is at most precision smaller than
+        the real one. By default DEFAULT_PRECISION times the shortest side of
+        the bounds of the polygon.
+    :return: x, y and distance
+    """
+    minx, miny, maxx, maxy = polygon.bounds
+    width, height = maxx - minx, maxy - miny
+    size = min(width, height)
+    if size == 0:
+        return minx, miny, 0.0
+    if precision is None:
+        precision = DEFAULT_PRECISION * size
+    half = size / 2
+    xs = np.arange(minx, maxx, size) + half
+    ys = np.arange(miny, maxy, size) + half
+    xs, ys = [x.ravel() for x in np.meshgrid(xs, ys)]
+    # The centroid is a good first guess
+    centroid = polygon.centroid
+    best_x, best_y = centroid.x, centroid.y
+    best = signed_distances(polygon, [best_x], [best_y])[0]
+    while len(xs):
+        distances = signed_distances(polygon, xs, ys)
+        i = int(np.argmax(distances))
+        if distances[i] > best:
+            best_x, best_y, best = float(xs[i]), float(ys[i]), float(distances[i])
+        # Largest distance that any point of each cell could have
+        potential = distances + half * math.sqrt(2)
+        keep = potential - best > precision
+        if half <= precision / 2:
+            break
+        half /= 2
+        xs, ys = xs[keep], ys[keep]
+        xs = np.concatenate([xs - half, xs + half, xs - half, xs + half])
+        ys = np.concatenate([ys - half, ys - half, ys + half, ys + half])
+    return best_x, best_y, max(best, 0.0)
+
+
+def label_box(
+    polygon: Polygon, ratio: float, precision=None, max_iterations=20
+) -> Optional[Polygon]:
+    """
+    Returns the largest box with width / height = ratio, parallel to the
+    axes and centered on the pole of inaccessibility of the polygon, that is
+    contained in it, or None.
+
+    The box inscribed in the circle around the pole is always contained, and
+    it is grown with a bisection over its height until the difference is
+    below precision.
+
+    :param polygon: shapely Polygon
+    :param ratio: width / height of the box
+    :param precision: see pole_of_inaccessibility
+    :param max_iterations: maximum number of bisection steps
+    :return: shapely Polygon
+    """
+    x, y, distance = pole_of_inaccessibility(polygon, precision)
+    if distance <= 0:
+        return None
+    minx, miny, maxx, maxy = polygon.bounds
+    if precision is None:
+        precision = DEFAULT_PRECISION * min(maxx - minx, maxy - miny)
+    prepared = prep(polygon)
+
+    def centered_box(height):
+        w, h = ratio * height / 2, height / 2
+        return box(x - w, y - h, x + w, y + h)
+
+    low = 2 * distance / math.sqrt(1 + ratio * ratio)
+    high = min(maxy - miny, (maxx - minx) / ratio)
+    for _ in range(max_iterations):
+        if high - low <= precision:
+            break
+        middle = (low + high) / 2
+        if prepared.contains(centered_box(middle)):
+            low = middle
+        else:
+            high = middle
+    return centered_box(low)
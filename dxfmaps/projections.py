@@ -1,5 +1,7 @@
 import math
 from math import sin, cos, tan, acos, pi, radians, log, sqrt
+import numpy as np
+from dxfmaps.utils import pack_polygons, unpack_polygons
 
 EARTH_RADIUS = 6378137
 MERCATOR = "mercator"
@@ -68,3 +70,189 @@ def lambert_azimuthal_equal_area(lon, lat, lon0=0, lat0=0):
     x = k * cos(lat) * sin(lon - lon0)
     y = k * (cos(lat0) * sin(lat) - sin(lat0) * cos(lat) * cos(lon - lon0))
     return x, y
+
+
+# Projection objects. Their parameters (center, scale) are given once and
+# every constant that depends only on them is computed in the constructor.
+# project() takes a (n, 2) array of longitudes and latitudes in degrees and
+# returns a (n, 2) array with the projected coordinates, transforming every
+# vertex in one go.
+
+
+class Projection:
+    name = None
+    # Names of the constructor arguments, kept as attributes of the same name
+    parameters = ()
+
+    def project(self, coords):
+        raise NotImplementedError
+
+    @property
+    def settings(self) -> dict:
+        return {x: getattr(self, x) for x in self.parameters}
+
+    def configured(self, **params) -> "Projection":
+        """Returns a projection of the same class with these settings updated
+        with params.
+        """
+        unknown = set(params) - set(self.parameters)
+        if unknown:
+            msg = "Unknown parameters for {}: {}"
+            raise ValueError(msg.format(type(self).__name__, ", ".join(sorted(unknown))))
+        settings = self.settings
+        settings.update(params)
+        return type(self)(**settings)
+
+    def __call__(self, lon, lat):
+        x, y = self.project(np.array([[lon, lat]], dtype=float))[0]
+        return float(x), float(y)
+
+    def project_polygons(self, polygons):
+        """Projects the exteriors and interiors of a list of shapely polygons
+        as a single block of coordinates.
+
+        :return: list of shapely polygons
+        """
+        coords, offsets, rings_count = pack_polygons(polygons)
+        return unpack_polygons(self.project(coords), offsets, rings_count)
+
+
+class AzimuthalEquidistant(Projection):
+    """Azimuthal (WIP)"""
+
+    name = AZIMUTAL_EQUIDISTANT
+
+    def project(self, coords):
+        coords = np.asarray(coords, dtype=float)
+        lon, lat = coords[:, 0], coords[:, 1]
+        x = lat * np.sin(lon)
+        y = -lat * np.cos(lon)
+        return np.column_stack((x, y))
+
+
+class Mercator(Projection):
+    """
+    rf -- Representative Factor (scale)
+    lon0 -- Arbitrary central meridian in degrees. Default is Greenwich
+    """
+
+    name = MERCATOR
+    parameters = ("rf", "lon0", "max_lat", "min_lat")
+
+    def __init__(self, rf=1.0 / 1000000.0, lon0=0, max_lat=85, min_lat=-89):
+        self.rf = rf
+        self.lon0 = lon0
+        self.lon0_rad = radians(lon0)
+        self.max_lat = max_lat
+        self.min_lat = min_lat
+        self.r = rf * EARTH_RADIUS
+
+    def project(self, coords):
+        coords = np.asarray(coords, dtype=float)
+        lon, lat = coords[:, 0], coords[:, 1]
+        x = self.r * (np.radians(lon) - self.lon0_rad)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y = self.r * np.log(np.tan(pi / 4.0 + np.radians(lat) / 2.0))
+        y = np.where(lat < self.min_lat, -20.26181, y)
+        return np.column_stack((x, y))
+
+
+class WinkelTripel(Projection):
+    """
+    lon0 -- Arbitrary central meridian in degrees. Default is Greenwich
+    """
+
+    name = WINKEL_TRIPEL
+    parameters = ("lon0",)
+
+    def __init__(self, lon0=0):
+        self.lon0 = lon0
+        self.lon0_rad = radians(lon0)
+        self.cos_phi1 = cos(acos(2.0 / pi))
+
+    def project(self, coords):
+        coords = np.asarray(coords, dtype=float)
+        lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+        lon = lon - self.lon0_rad
+        cos_lat = np.cos(lat)
+        alpha = np.arccos(cos_lat * np.cos(lon / 2.0))
+        # np.sinc is the normalized sinc, sin(pi * x) / (pi * x)
+        sin_alpha = np.sinc(alpha / pi)
+        x = 1 / 2.0 * (lon * self.cos_phi1 + (2 * cos_lat * np.sin(lon / 2.0)) / sin_alpha)
+        y = 1 / 2.0 * (lat + np.sin(lat) / sin_alpha)
+        return np.column_stack((x, y))
+
+
+class LambertAzimuthalEqualArea(Projection):
+    """
+    lon0, lat0 -- Center of the projection in degrees
+    """
+
+    name = LAMBERTAZIMUTAL
+    parameters = ("lon0", "lat0")
+
+    def __init__(self, lon0=0, lat0=0):
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.lon0_rad = radians(lon0)
+        self.sin_lat0 = sin(radians(lat0))
+        self.cos_lat0 = cos(radians(lat0))
+
+    def project(self, coords):
+        coords = np.asarray(coords, dtype=float)
+        lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+        lon = lon - self.lon0_rad
+        sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+        cos_lon = np.cos(lon)
+        k = np.sqrt(2 / (1 + self.sin_lat0 * sin_lat + self.cos_lat0 * cos_lat * cos_lon))
+        x = k * cos_lat * np.sin(lon)
+        y = k * (self.cos_lat0 * sin_lat - self.sin_lat0 * cos_lat * cos_lon)
+        return np.column_stack((x, y))
+
+
+PROJECTIONS = {
+    AZIMUTAL_EQUIDISTANT: AzimuthalEquidistant(),
+    MERCATOR: Mercator(),
+    WINKEL_TRIPEL: WinkelTripel(),
+    LAMBERTAZIMUTAL: LambertAzimuthalEqualArea(),
+}
+
+
+def register_projection(name: str, projection: Projection) -> None:
+    """Registers a configured projection so it can be used by name, e.g.
+    register_projection("europe", LambertAzimuthalEqualArea(10, 52))
+    """
+    PROJECTIONS[name] = projection
+
+
+def get_projection(projection, **params) -> Projection:
+    """Returns a projection object from a Projection or a registered name.
+
+    If params are given along with a name, a new projection is configured
+    with the settings of the registered one updated with them, e.g.
+    get_projection(MERCATOR, lon0=30)
+    """
+    if isinstance(projection, Projection):
+        if params:
+            raise ValueError("Parameters can only be given with a name")
+        return projection
+    if projection not in PROJECTIONS:
+        raise ValueError("Unknown projection {}".format(projection))
+    projection_object = PROJECTIONS[projection]
+    if params:
+        return projection_object.configured(**params)
+    return projection_object
+
+
+def project_array(projection, coords, **params):
+    """Projects a (n, 2) array of GPS coordinates with the given projection"""
+    return get_projection(projection, **params).project(coords)
+
+
+def project_polygons(polygons, projection, **params):
+    """Projects the exteriors and interiors of a list of shapely polygons as a
+    single block of coordinates.
+
+    :return: list of shapely polygons
+    """
+    return get_projection(projection, **params).project_polygons(polygons)
@@ -0,0 +1,226 @@
+import numpy as np
+from shapely.affinity import rotate
+from shapely.geometry import Polygon
+from shapely.prepared import prep
+from typing import Optional
+
+DEFAULT_ANGLES = tuple(range(-90, 90, 15))
+# Maximum number of (point, edge) pairs evaluated at once, which bounds the
+# size of the temporary arrays
+MAX_PAIRS = 1 << 20
+
+
+def polygon_edges(polygon: Polygon):
+    """Returns the edges of every ring of the polygon as four arrays x0, y0,
+    x1, y1.
+    """
+    rings = [polygon.exterior] + list(polygon.interiors)
+    edges = []
+    for ring in rings:
+        coords = np.asarray(ring.coords)[:, :2]
+        edges.append(np.hstack((coords[:-1], coords[1:])))
+    edges = np.concatenate(edges)
+    return edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+
+
+def points_chunk(edges, chunk=None) -> int:
+    """Number of points tested at once against edges edges, so there are at
+    most MAX_PAIRS pairs, or chunk if given.
+    """
+    if chunk is None:
+        chunk = MAX_PAIRS // max(edges, 1)
+    return max(1, chunk)
+
+
+def points_in_polygon(polygon: Polygon, xs, ys, chunk=None):
+    """Returns a boolean array telling which points are inside the polygon,
+    using the even-odd rule over chunks of points and all the edges at once.
+    Points exactly on the boundary may go either way.
+    """
+    xs = np.asarray(xs, dtype=float).ravel()
+    ys = np.asarray(ys, dtype=float).ravel()
+    x0, y0, x1, y1 = polygon_edges(polygon)
+    chunk = points_chunk(len(x0), chunk)
+    inside = np.zeros(len(xs), dtype=bool)
+    for start in range(0, len(xs), chunk):
+        px = xs[start : start + chunk, None]
+        py = ys[start : start + chunk, None]
+        crosses = (y0 > py) != (y1 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        crossings = np.count_nonzero(crosses & (px < x_cross), axis=1)
+        inside[start : start + chunk] = crossings % 2 == 1
+    return inside
+
+
+def points_on_boundary(polygon: Polygon, xs, ys, chunk=None):
+    """Returns a boolean array telling which points lie exactly on one of the
+    edges of the polygon.
+    """
+    xs = np.asarray(xs, dtype=float).ravel()
+    ys = np.asarray(ys, dtype=float).ravel()
+    x0, y0, x1, y1 = polygon_edges(polygon)
+    chunk = points_chunk(len(x0), chunk)
+    on_boundary = np.zeros(len(xs), dtype=bool)
+    for start in range(0, len(xs), chunk):
+        px = xs[start : start + chunk, None]
+        py = ys[start : start + chunk, None]
+        cross = (x1 - x0) * (py - y0) - (y1 - y0) * (px - x0)
+        within_x = (np.minimum(x0, x1) <= px) & (px <= np.maximum(x0, x1))
+        within_y = (np.minimum(y0, y1) <= py) & (py <= np.maximum(y0, y1))
+        on_edge = (cross == 0) & within_x & within_y
+        on_boundary[start : start + chunk] = on_edge.any(axis=1)
+    return on_boundary
+
+
+def rasterize(polygon: Polygon, resolution: int):
+    """Rasterizes the polygon into a boolean mask with resolution cells on
+    its longest side. A cell is inside when its center is inside.
+
+    :return: mask, x and y of the lower left corner of the grid and the size
+        of the cells
+    """
+    minx, miny, maxx, maxy = polygon.bounds
+    cell = max(maxx - minx, maxy - miny) / resolution
+    columns = max(1, int(np.ceil((maxx - minx) / cell)))
+    rows = max(1, int(np.ceil((maxy - miny) / cell)))
+    xs = minx + (np.arange(columns) + 0.5) * cell
+    ys = miny + (np.arange(rows) + 0.5) * cell
+    x0, y0, x1, y1 = polygon_edges(polygon)
+    # Scanlines: x coordinate where every edge crosses the center of each row
+    py = ys[:, None]
+    crosses = (y0 > py) != (y1 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    mask = np.zeros((rows, columns), dtype=bool)
+    for row in range(rows):
+        crossings = np.sort(x_cross[row][crosses[row]])
+        mask[row] = np.searchsorted(crossings, xs) % 2 == 1
+    return mask, minx, miny, cell
+
+
+def summed_area_table(mask):
+    """Summed area table of the cells outside the mask, padded with a row
+    and a column of zeros.
+    """
+    table = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+    table[1:, 1:] = (~mask).cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def fitting_windows(table, height, width):
+    """Returns a boolean array with the positions of the lower left cell of
+    every height x width window that has no cell outside the mask.
+    """
+    rows, columns = table.shape[0] - 1, table.shape[1] - 1
+    if height > rows or width > columns:
+        return np.zeros((0, 0), dtype=bool)
+    outside = (
+        table[height:, width:]
+        - table[:-height, width:]
+        - table[height:, :-width]
+        + table[:-height, :-width]
+    )
+    return outside == 0
+
+
+def largest_window(mask, ratio):
+    """Finds the tallest window of cells, width = ceil(ratio * height), with
+    no cell outside the mask, with a binary search over its height.
+
+    :return: row, column, height and width in cells, or None
+    """
+    table = summed_area_table(mask)
+    low, high = 0, mask.shape[0]
+    best = None
+    while low < high:
+        height = (low + high + 1) // 2
+        width = max(1, int(np.ceil(ratio * height)))
+        fits = fitting_windows(table, height, width)
+        if fits.any():
+            low = height
+            best = (fits, height, width)
+        else:
+            high = height - 1
+    if best is None:
+        return None
+    fits, height, width = best
+    rows, columns = np.nonzero(fits)
+    # Among the positions that fit, take the one closest to their center
+    distance = (rows - rows.mean()) ** 2 + (columns - columns.mean()) ** 2
+    i = int(np.argmin(distance))
+    return rows[i], columns[i], height, width
+
+
+def axis_rectangle(polygon: Polygon, ratio: float, resolution: int):
+    """Largest axis parallel rectangle with width / height = ratio found in
+    the rasterized polygon.
+    """
+    mask, minx, miny, cell = rasterize(polygon, resolution)
+    window = largest_window(mask, ratio)
+    if window is None:
+        return None
+    row, column, height, width = window
+    h = height * cell
+    w = ratio * h
+    cx = minx + (column + width / 2.0) * cell
+    cy = miny + (row + height / 2.0) * cell
+    return Polygon(
+        [
+            (cx - w / 2, cy - h / 2),
+            (cx + w / 2, cy - h / 2),
+            (cx + w / 2, cy + h / 2),
+            (cx - w / 2, cy + h / 2),
+        ]
+    )
+
+
+def shrink_to_fit(polygon, rectangle, factor=0.95, max_iterations=10):
+    """The raster only tests the centers of the cells, so the rectangle may
+    cross the boundary of the polygon slightly. Scales it down around its
+    centroid until it is contained.
+    """
+    prepared = prep(polygon)
+    center = rectangle.centroid
+    for _ in range(max_iterations):
+        if prepared.contains(rectangle):
+            return rectangle
+        coords = np.asarray(rectangle.exterior.coords)
+        coords = (coords - (center.x, center.y)) * factor + (center.x, center.y)
+        rectangle = Polygon(coords)
+    return None
+
+
+def largest_inscribed_rectangle(
+    polygon: Polygon, ratio: float, resolution=64, angles=DEFAULT_ANGLES
+) -> Optional[Polygon]:
+    """
+    Returns a large rectangle with width / height = ratio contained in the
+    polygon, or None.
+
+    For each candidate angle the polygon is rotated, rasterized into a
+    boolean mask and the largest window of cells that fits is found with a
+    summed area table. The biggest rectangle over all angles is rotated back.
+
+    :param polygon: shapely Polygon
+    :param ratio: width / height of the rectangle
+    :param resolution: number of cells on the longest side of the raster
+    :param angles: rotations, in degrees, to try
+    :return: shapely Polygon
+    """
+    origin = polygon.centroid
+    best = None
+    for angle in angles:
+        rotated = rotate(polygon, -angle, origin=origin)
+        rectangle = axis_rectangle(rotated, ratio, resolution)
+        if rectangle is None:
+            continue
+        if best is None or rectangle.area > best[0].area:
+            best = (rectangle, rotated, angle)
+    if best is None:
+        return None
+    rectangle, rotated, angle = best
+    rectangle = shrink_to_fit(rotated, rectangle)
+    if rectangle is None:
+        return None
+    return rotate(rectangle, angle, origin=origin)
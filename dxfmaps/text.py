@@ -1,16 +1,174 @@
-import shapely.wkt
-from shapely import affinity, geometry
+import os
+from collections import namedtuple
+import numpy as np
+from shapely import geometry
 from dxfmaps import utils
-from .fonts import *
+from dxfmaps.glyphs import FontFile, get_font, glyph_from_wkt
 import cairocffi as cairo
 
+DEFAULT_FONT = "VERA"
+# Maximum number of string layouts kept by each GlyphAtlas
+LAYOUT_CACHE_SIZE = 4096
+
+
+class GlyphAtlas:
+    """
+    The glyphs of a font as packed coordinate arrays, read once, and the
+    layouts of the strings already built with them.
+
+    Attributes:
+        self.font: a dxfmaps.glyphs.FontFile or a dictionary mapping
+        characters to WKT geometries
+        self.glyphs: dictionary mapping characters to Glyph tuples
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.glyphs = {}
+        self._layouts = {}
+        self._em_width = None
+
+    def glyph(self, char):
+        """Returns the Glyph of a character, or None if it's not in the font"""
+        glyph = self.glyphs.get(char)
+        if glyph is None and char in self.font:
+            if isinstance(self.font, dict):
+                glyph = glyph_from_wkt(self.font[char])
+            else:
+                glyph = self.font.glyph(char)
+            self.glyphs[char] = glyph
+        return glyph
+
+    @property
+    def em_width(self):
+        if self._em_width is None:
+            m = self.glyph("M")
+            self._em_width = m.maxx - m.minx
+        return self._em_width
+
+    def positions(self, string, spacing):
+        """Places the glyphs of the string one after the other, spacing apart.
+        Returns a list of (character, Glyph, x offset) with the characters in
+        the font.
+        """
+        positions = []
+        right_bound = None
+        for char in string:
+            glyph = self.glyph(char)
+            if glyph is None:
+                continue
+            x_offset = 0.0
+            if right_bound is not None:
+                x_offset = right_bound - glyph.minx + spacing
+            positions.append((char, glyph, x_offset))
+            right_bound = glyph.maxx + x_offset
+        return positions
+
+    def layout(self, string, spacing):
+        """Returns the packed coordinates, offsets and rings count of the
+        glyphs of the string, placed as in positions. The arrays are shared
+        between calls and must not be modified.
+        """
+        key = (string, spacing)
+        layout = self._layouts.get(key)
+        if layout is not None:
+            return layout
+        for char in string:
+            if self.glyph(char) is None:
+                msg = "Character {} not in font.({})".format(ord(char), string)
+                print(msg)
+        chunks = []
+        ring_sizes = []
+        rings_count = []
+        for _, glyph, x_offset in self.positions(string, spacing):
+            chunks.append(glyph.coords + (x_offset, 0.0))
+            ring_sizes.append(np.diff(glyph.offsets))
+            rings_count.extend(glyph.rings_count)
+        if chunks:
+            coords = np.concatenate(chunks)
+            ring_sizes = np.concatenate(ring_sizes)
+        else:
+            coords = np.empty((0, 2))
+        offsets = np.zeros(len(ring_sizes) + 1, dtype=np.int64)
+        np.cumsum(ring_sizes, out=offsets[1:])
+        if len(self._layouts) >= LAYOUT_CACHE_SIZE:
+            self._layouts.clear()
+        layout = (coords, offsets, rings_count)
+        self._layouts[key] = layout
+        return layout
+
+
+_atlases = {}
+
+
+def get_atlas(font) -> GlyphAtlas:
+    """Returns the GlyphAtlas of a font, building it the first time. Fonts
+    are given by their registered name, see dxfmaps.glyphs.register_font,
+    or as in GlyphAtlas.
+    """
+    if isinstance(font, str):
+        key = font.upper()
+        font = get_font(font)
+    elif isinstance(font, FontFile):
+        key = ("path", os.path.abspath(font.path))
+    else:
+        # The atlas keeps the font alive, so its id is not reused
+        key = id(font)
+    atlas = _atlases.get(key)
+    # Names can be registered again with another font
+    if atlas is None or atlas.font is not font and isinstance(key, str):
+        atlas = GlyphAtlas(font)
+        _atlases[key] = atlas
+    return atlas
+
+
+class TextLabel(
+    namedtuple("TextLabel", ["string", "font", "spacing", "matrix", "start", "end"])
+):
+    """
+    A Text placed in the map, as the affine transformation from the layout
+    of the string to the map. start and end are the positions of its
+    polygons in the labels of the country. Lets exporters draw the glyphs
+    instead of the polygons, see dxfmaps.dxf.
+    """
+
+    __slots__ = ()
+
+    def transformed(self, matrix) -> "TextLabel":
+        return self._replace(matrix=utils.compose(self.matrix, matrix))
+
 
 class Text:
-    def __init__(self, string, font=VERA, relative_spacing=0.05):
+    """
+    The outline of a string as polygons. The coordinates of all the glyphs
+    are kept in a single array, and transformations are applied to it as a
+    whole. Shapely polygons are only built when self.polygons is read.
+
+    self.matrix is the affine transformation applied since the layout of the
+    string, or None once the polygons are replaced.
+    """
+
+    def __init__(self, string, font=DEFAULT_FONT, relative_spacing=0.05):
         self.string = string
         self.font = font
+        self.atlas = get_atlas(font)
         self.spacing = relative_spacing * self.em_width
-        self.polygons = self._build_polygons()
+        layout = self.atlas.layout(string, self.spacing)
+        self._coords, self._offsets, self._rings_count = layout
+        self._polygons = None
+        self.matrix = utils.IDENTITY
+
+    @property
+    def polygons(self):
+        if self._polygons is None:
+            self._polygons = self._build_polygons()
+        return self._polygons
+
+    @polygons.setter
+    def polygons(self, polygons):
+        self._coords, self._offsets, self._rings_count = utils.pack_polygons(polygons)
+        self._polygons = polygons
+        self.matrix = None
 
     @property
     def as_multipolygon(self):
@@ -36,66 +194,80 @@ class Text:
 
     @property
     def bounds(self):
-        return self.as_multipolygon.bounds
+        if len(self._coords) == 0:
+            return self.as_multipolygon.bounds
+        minx, miny = self._coords.min(axis=0).tolist()
+        maxx, maxy = self._coords.max(axis=0).tolist()
+        return minx, miny, maxx, maxy
+
+    @property
+    def footprint(self):
+        """Convex hull of the glyphs, the area covered by the text"""
+        return geometry.MultiPoint(self._coords.tolist()).convex_hull
+
+    @property
+    def center(self):
+        """Center of the bounds"""
+        minx, miny, maxx, maxy = self.bounds
+        return (minx + maxx) / 2, (miny + maxy) / 2
 
     @property
     def em_width(self):
-        m = shapely.wkt.loads(self.font["M"])
-        minx, miny, maxx, maxy = m.bounds
-        em_width = maxx - minx
-        return em_width
+        return self.atlas.em_width
 
     def _build_polygons(self):
-        string = self.string
-        font = self.font
-        geoms = []
-        right_bounds = []
-        for char in string:
-            if char not in font:
-                msg = "Character {} not in font.({})".format(ord(char), string)
-                if right_bounds:
-                    right_bounds.append(right_bounds[-1])
-                print(msg)
-                continue
-            geom = shapely.wkt.loads(font[char])
-            minx, _, _, _ = geom.bounds
-            if right_bounds:
-                x_offset = right_bounds[-1] - minx + self.spacing
-                geom = affinity.translate(geom, xoff=x_offset)
-            _, _, maxx, _ = geom.bounds
-            right_bounds.append(maxx)
-            geoms.extend(utils.get_polygons(geom))
-        return geoms
+        return utils.unpack_polygons(self._coords, self._offsets, self._rings_count)
+
+    def transform(self, matrix):
+        """Applies an affine transformation, see utils.compose"""
+        self._coords = utils.affine_coords(self._coords, matrix)
+        self._polygons = None
+        if self.matrix is not None:
+            self.matrix = utils.compose(self.matrix, matrix)
+
+    def as_label(self, start):
+        """Returns the TextLabel of the text, with its polygons placed at
+        start in the labels of the country, or None if its polygons were
+        replaced.
+        """
+        if self.matrix is None:
+            return None
+        end = start + len(self.polygons)
+        return TextLabel(self.string, self.font, self.spacing, self.matrix, start, end)
+
+    def _around(self, matrix, origin=None):
+        """Returns the transformation matrix with its origin moved to origin,
+        by default the center of the bounds.
+        """
+        x0, y0 = self.center if origin is None else (origin.x, origin.y)
+        matrix = utils.compose(utils.translation(-x0, -y0), matrix)
+        return utils.compose(matrix, utils.translation(x0, y0))
 
     def rotate(self, angle, origin=None):
-        multipolygon = geometry.MultiPolygon(self.polygons)
-        multipolygon = affinity.rotate(multipolygon, angle, origin=origin)
-        self.polygons = [x for x in multipolygon]
+        self.transform(self._around(utils.rotation(angle), origin))
 
     def scale(self, factor):
         """
         Scales the geometries to a specific width
         """
-        multipolygon = geometry.MultiPolygon(self.polygons)
-        multipolygon = affinity.scale(multipolygon, xfact=factor, yfact=factor)
-        self.polygons = [x for x in multipolygon]
+        self.transform(self._around(utils.scaling(factor)))
 
     def translate_to(self, target):
         """
         Translates all the geometries to the origin (0, 0)
         """
-        text_center = self.envelope.centroid
-        x_offset = target.x - text_center.x
-        y_offset = target.y - text_center.y
-        new_elements = []
-        for poly in self.polygons:
-            new = affinity.translate(poly, xoff=x_offset, yoff=y_offset)
-            new_elements.append(new)
-        self.polygons = new_elements
+        x0, y0 = self.center
+        self.transform(utils.translation(target.x - x0, target.y - y0))
 
     def move_and_fit_box(self, rectangle):
+        """Scales the text to fit in the rotated rectangle and moves it to its
+        center, with a single transformation.
+        """
         w, h, angle = utils.width_angle(rectangle)
         factor = min(w / self.width, h / self.height)
-        self.scale(factor)
-        self.translate_to(rectangle.centroid)
-        self.rotate(angle, origin=rectangle.centroid)
+        target = rectangle.centroid
+        x0, y0 = self.center
+        matrix = utils.compose(utils.translation(-x0, -y0), utils.scaling(factor))
+        matrix = utils.compose(matrix, utils.rotation(angle))
+        matrix = utils.compose(matrix, utils.translation(target.x, target.y))
+        self.transform(matrix)
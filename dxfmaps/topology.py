@@ -0,0 +1,170 @@
+import numpy as np
+from shapely.geometry import LineString, Polygon
+from typing import List
+from dxfmaps.country import Country
+
+
+class Topology:
+    """
+    Rings of a set of countries split into arcs, so a border shared by two
+    neighbours is stored, and simplified, only once.
+
+    A vertex is a junction when it appears in several rings with different
+    neighbours, e.g. where the border between two countries meets the coast.
+    Rings are cut at their junctions, and rings without junctions (islands,
+    enclaves) are kept as closed arcs.
+
+    Attributes:
+        self.points: (n, 2) array with every distinct vertex
+        self.arcs: list of arcs, each one a tuple of indexes into self.points
+        self.rings: for each ring, a list of (arc index, reversed) tuples
+        self.countries: for each country, a list of polygons, each one a list
+        of ring indexes with the exterior first
+        self.names: name of each country
+    """
+
+    def __init__(self, countries: List[Country]):
+        self.names = [x.name for x in countries]
+        rings = []
+        self.countries = []
+        for country in countries:
+            polygons = []
+            for polygon in country.contours:
+                ring_ids = []
+                for ring in [polygon.exterior] + list(polygon.interiors):
+                    ring_ids.append(len(rings))
+                    # Rings are stored open, without repeating the first vertex
+                    rings.append(np.asarray(ring.coords)[:-1, :2])
+                polygons.append(ring_ids)
+            self.countries.append(polygons)
+        if rings:
+            coords = np.concatenate(rings)
+        else:
+            coords = np.empty((0, 2))
+        self.points, ids = np.unique(coords, axis=0, return_inverse=True)
+        ids = ids.reshape(-1)
+        sizes = [len(x) for x in rings]
+        starts = np.concatenate(([0], np.cumsum(sizes)))
+        junctions = self._junctions(ids, starts)
+        self.arcs = []
+        self.rings = []
+        arc_index = {}
+        for i in range(len(rings)):
+            ring = ids[starts[i] : starts[i + 1]]
+            ring_arcs = []
+            for arc in self._split(ring, junctions):
+                key = min(arc, arc[::-1])
+                if key not in arc_index:
+                    arc_index[key] = len(self.arcs)
+                    self.arcs.append(key)
+                ring_arcs.append((arc_index[key], key != arc))
+            self.rings.append(ring_arcs)
+
+    @staticmethod
+    def _junctions(ids, starts):
+        """Returns a boolean array telling which points are junctions"""
+        count = len(ids)
+        position = np.arange(count)
+        ring = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+        ring_start, ring_end = starts[ring], starts[ring + 1]
+        previous = np.where(position == ring_start, ring_end - 1, position - 1)
+        following = np.where(position == ring_end - 1, ring_start, position + 1)
+        neighbours = np.sort(np.column_stack((ids[previous], ids[following])), axis=1)
+        occurrences = np.unique(np.column_stack((ids, neighbours)), axis=0)
+        different_neighbours = np.bincount(occurrences[:, 0], minlength=len(ids))
+        return different_neighbours > 1
+
+    @staticmethod
+    def _split(ring, junctions):
+        """Cuts a ring, given as point indexes, at its junctions. Returns a list
+        of arcs as tuples, each one starting and ending at a junction. A ring
+        without junctions gives a single closed arc starting at its smallest
+        index.
+        """
+        positions = np.flatnonzero(junctions[ring])
+        if len(positions) == 0:
+            start = int(np.argmin(ring))
+            ring = np.roll(ring, -start)
+            forward = tuple(ring.tolist()) + (int(ring[0]),)
+            return [forward]
+        ring = np.roll(ring, -positions[0])
+        positions = positions - positions[0]
+        closed = np.append(ring, ring[0])
+        cuts = list(positions) + [len(ring)]
+        arcs = []
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            arcs.append(tuple(closed[start : end + 1].tolist()))
+        return arcs
+
+    def simplified_arcs(self, tolerance):
+        """Simplifies every arc once with the Douglas-Peucker algorithm. The
+        endpoints of the arcs, the junctions, are always kept.
+        """
+        arcs = []
+        for arc in self.arcs:
+            coords = self.points[list(arc)]
+            if len(coords) > 2:
+                line = LineString(coords)
+                simplified = line.simplify(tolerance, preserve_topology=False)
+                simplified = np.asarray(simplified.coords)[:, :2]
+                if arc[0] == arc[-1] and len(simplified) < 4:
+                    simplified = self._simplified_ring(coords, tolerance)
+                coords = simplified
+            arcs.append(coords)
+        return arcs
+
+    @staticmethod
+    def _simplified_ring(coords, tolerance):
+        """Simplifies a closed arc that collapses as a line, simplifying it as
+        a polygon instead. The result must still start at the first vertex of
+        the arc, otherwise the arc is not simplified.
+        """
+        simplified = np.asarray(Polygon(coords).simplify(tolerance).exterior.coords)
+        simplified = simplified[:-1, :2]
+        start = np.flatnonzero((simplified == coords[0]).all(axis=1))
+        if len(simplified) < 3 or len(start) == 0:
+            return coords
+        simplified = np.roll(simplified, -start[0], axis=0)
+        return np.vstack((simplified, simplified[:1]))
+
+    def _ring(self, arcs, ring):
+        parts = []
+        for arc, reversed_arc in self.rings[ring]:
+            coords = arcs[arc][::-1] if reversed_arc else arcs[arc]
+            parts.append(coords if not parts else coords[1:])
+        coords = np.concatenate(parts)
+        if len(coords) < 4:
+            return None
+        return coords
+
+    def simplify(self, tolerance, countries: List[Country]) -> List[Country]:
+        """Returns the given countries, which must be the ones this topology
+        was built from, with their contours simplified. Shared borders are
+        simplified in the same way on both sides.
+
+        Rings that collapse are removed. A country left without polygons is
+        simplified on its own instead.
+        """
+        arcs = self.simplified_arcs(tolerance)
+        new_countries = []
+        for country, polygons in zip(countries, self.countries):
+            new_polygons = []
+            for ring_ids in polygons:
+                exterior = self._ring(arcs, ring_ids[0])
+                if exterior is None:
+                    continue
+                interiors = [self._ring(arcs, x) for x in ring_ids[1:]]
+                interiors = [x for x in interiors if x is not None]
+                new_polygons.append(Polygon(exterior, interiors))
+            if new_polygons:
+                new_countries.append(Country(new_polygons, country.name))
+            else:
+                new_countries.append(country.simplify(tolerance))
+        return new_countries
+
+
+def simplify_countries(countries: List[Country], tolerance) -> List[Country]:
+    """Simplifies the contours of the countries keeping the borders between
+    neighbours shared, so there are no gaps nor overlaps between them.
+    """
+    return Topology(countries).simplify(tolerance, countries)
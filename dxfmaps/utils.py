@@ -1,9 +1,12 @@
 from shapely import affinity
 from shapely.geometry import Polygon, MultiPolygon, Point
+from shapely.prepared import prep
 import time
 import random
 from operator import attrgetter
 import math
+import numpy as np
+from dxfmaps.catalog import Catalog
 
 WORLD_COUNTRIES = "../shpf/10m-0-countries/ne_10m_admin_0_countries.shp"
 WORLD_PROVINCES = ("/shpf/10m-1-states-provinces/"
@@ -34,26 +37,50 @@ def greatest_contained_rectangle(polygon, points_count=20):
     return polygon
 
 
-def inner_rectangle(polygon: Polygon) -> object:
-    """Returns a shapely box contained in a given polygon.
+def inner_rectangle(polygon: Polygon, max_iterations=20) -> object:
+    """Returns a shapely box contained in a given polygon, or None if none is
+    found.
 
     This is not the largest contained rectangle, but it is a relatively large
     rectangle that is guaranteed to be contained in the given polygon. This is
     faster than finding the largest contained rectangle.
-    """
-    p = 0.02
-    increment = reduction_increment(polygon)
-    buffered = polygon.buffer(increment, 1)
-    while True:
+
+    The polygon is shrunk with a negative buffer until the minimum rotated
+    rectangle of the result is contained in the polygon. The buffer distance
+    is doubled, starting from reduction_increment, until it works, and then
+    found with a bisection to reduction_increment. Each buffer shrinks the
+    largest shape that didn't fit by the remaining distance, so buffers stay
+    small however much the polygon is shrunk. At most max_iterations buffers
+    are computed.
+    """
+    prepared = prep(polygon)
+    step = -reduction_increment(polygon)
+    # Buffers are much cheaper on a simplified polygon, and the rectangles
+    # are still tested against the original one
+    shape = polygon.simplify(step / 2)
+    low, high = 0.0, None
+    best = None
+    distance = step
+    for _ in range(max_iterations):
+        if high is not None:
+            if high - low <= step:
+                break
+            distance = (low + high) / 2
+        buffered = shape.buffer(low - distance, 1)
+        if buffered.is_empty:
+            high = distance
+            continue
         if isinstance(buffered, MultiPolygon):
             buffered = max_area_polygon(buffered)
-        if polygon.contains(buffered.minimum_rotated_rectangle):
-            break
-        if p * polygon.area > buffered.area:
-            print("Area break")
-            break
-        buffered = buffered.buffer(increment, 1)
-    return buffered.minimum_rotated_rectangle
+        rectangle = buffered.minimum_rotated_rectangle
+        if prepared.contains(rectangle):
+            best = rectangle
+            high = distance
+        else:
+            shape, low = buffered, distance
+            if high is None:
+                distance *= 2
+    return best
 
 
 def vertical_flip_old(geometry):
@@ -75,7 +102,7 @@ def vertical_flip(polygons_list):
     """
     multi = MultiPolygon(polygons_list)
     multi = affinity.scale(multi, xfact=1.0, yfact=-1.0)
-    return [x for x in multi]
+    return list(multi.geoms)
 
 
 def random_point_in(polygon):
@@ -95,7 +122,7 @@ def max_area_polygon(multipolygon):
     Returns the polygon with greatest area inside a multipolygon
     """
     # TODO - Try without using attrgetter
-    return max(multipolygon, key=attrgetter("area"))
+    return max(multipolygon.geoms, key=attrgetter("area"))
 
 
 def multipolygon_to_polygon(geometry):  # TODO: Deprecated?
@@ -122,11 +149,110 @@ def get_polygons(geometry):
     if isinstance(geometry, Polygon):
         return [geometry]
     elif isinstance(geometry, MultiPolygon):
-        return list(geometry)
+        return list(geometry.geoms)
     else:
         raise Exception("Non valid geometry {}".format(type(geometry)))
 
 
+def pack_polygons(polygons):
+    """Returns the coordinates of every ring of the given polygons in a single
+    (n, 2) numpy array, along with the offsets of each ring in that array and
+    the number of rings of each polygon. Exteriors go before their interiors.
+    """
+    rings = []
+    rings_count = []
+    for polygon in polygons:
+        rings.append(np.asarray(polygon.exterior.coords)[:, :2])
+        for interior in polygon.interiors:
+            rings.append(np.asarray(interior.coords)[:, :2])
+        rings_count.append(len(polygon.interiors) + 1)
+    offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in rings], out=offsets[1:])
+    if rings:
+        coords = np.concatenate(rings)
+    else:
+        coords = np.empty((0, 2))
+    return coords, offsets, rings_count
+
+
+def unpack_polygons(coords, offsets, rings_count):
+    """Builds the list of shapely polygons packed by pack_polygons"""
+    polygons = []
+    ring = 0
+    for count in rings_count:
+        rings = [coords[offsets[i] : offsets[i + 1]] for i in range(ring, ring + count)]
+        polygons.append(Polygon(rings[0], rings[1:]))
+        ring += count
+    return polygons
+
+
+# 2D affine transformations are given as 6-tuples (a, b, d, e, xoff, yoff),
+# the same order used by shapely.affinity.affine_transform:
+#   x' = a * x + b * y + xoff
+#   y' = d * x + e * y + yoff
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def compose(first, second):
+    """Returns the affine transformation that applies first and then second"""
+    a1, b1, d1, e1, x1, y1 = first
+    a2, b2, d2, e2, x2, y2 = second
+    return (
+        a2 * a1 + b2 * d1,
+        a2 * b1 + b2 * e1,
+        d2 * a1 + e2 * d1,
+        d2 * b1 + e2 * e1,
+        a2 * x1 + b2 * y1 + x2,
+        d2 * x1 + e2 * y1 + y2,
+    )
+
+
+def translation(x_offset, y_offset):
+    return (1.0, 0.0, 0.0, 1.0, x_offset, y_offset)
+
+
+def scaling(xfact, yfact=None):
+    """Scaling with origin at (0, 0)"""
+    if yfact is None:
+        yfact = xfact
+    return (xfact, 0.0, 0.0, yfact, 0.0, 0.0)
+
+
+def rotation(angle):
+    """Counterclockwise rotation, in degrees, with origin at (0, 0)"""
+    cos = math.cos(math.radians(angle))
+    sin = math.sin(math.radians(angle))
+    return (cos, -sin, sin, cos, 0.0, 0.0)
+
+
+def transform_bounds(bounds, matrix):
+    """Returns the bounds after an affine transformation without rotation nor
+    shear, which keeps the sides of the bounding box parallel to the axes.
+    """
+    a, _, _, e, xoff, yoff = matrix
+    minx, miny, maxx, maxy = bounds
+    x0, x1 = sorted((a * minx + xoff, a * maxx + xoff))
+    y0, y1 = sorted((e * miny + yoff, e * maxy + yoff))
+    return x0, y0, x1, y1
+
+
+def affine_coords(coords, matrix):
+    """Applies the affine transformation to a (n, 2) array of coordinates"""
+    a, b, d, e, xoff, yoff = matrix
+    x, y = coords[:, 0], coords[:, 1]
+    return np.column_stack((a * x + b * y + xoff, d * x + e * y + yoff))
+
+
+def affine_polygons(polygons, matrix):
+    """Applies the affine transformation to a list of shapely polygons,
+    transforming all their coordinates as a single block.
+    """
+    if matrix == IDENTITY or not polygons:
+        return list(polygons)
+    coords, offsets, rings_count = pack_polygons(polygons)
+    return unpack_polygons(affine_coords(coords, matrix), offsets, rings_count)
+
+
 def centroid_as_polygon(rectangle, relative_size=0.05):
     """
     Returns a round shapely.polygon that represents the centroid of the
@@ -223,8 +349,8 @@ def reduction_increment(polygon, ratio=0.01):
 
 
 def list_of_countries(sf):
-    for x in sf.shapeRecords():
-        print("Name: {} ({})".format(x.record["NAME"], x.record.oid))
+    for oid, record in enumerate(Catalog.from_reader(sf).records):
+        print("Name: {} ({})".format(record["NAME"], oid))
 
 
 def list_of_continents(sf):
@@ -232,9 +358,7 @@ def list_of_continents(sf):
     Prints a list of the continents in the shapefile.
     """
     print("\n Continents available: ")
-    continents = set()
-    for x in sf.shapeRecords():
-        continents.add(x.record["CONTINENT"])
+    continents = Catalog.from_reader(sf).continents
     for item in continents:
         print(item)
     print()
@@ -259,10 +383,9 @@ def countries_by_continent(sf, continent):
     Prints a list of countries that match the specified continent in the
     shapefile.
     """
-    records = sf.records()
-    for item in records:
-        if item["CONTINENT"] == continent:
-            print(item["NAME"], item.oid)
+    catalog = Catalog.from_reader(sf)
+    for oid in catalog.continent_oids(continent):
+        print(catalog.record(oid)["NAME"], oid)
 
 
 def polygons_to_svg(
@@ -7,7 +7,7 @@ AREA_LIMIT = 2.0
 
 
 def main():
-    map = Map(WORLD_COUNTRIES, continent="europe")
+    map = Map(WORLD_COUNTRIES, continent="europe", cache=True)
     map.filter_by_area(area_limit=AREA_LIMIT)
     map.simplify(tolerance=TOLERANCE)
     map.info()
@@ -75,7 +75,7 @@ def main():
 
     for country in countries:
         country_set = set([country])
-        map_by_pieces = Map(WORLD_COUNTRIES, countries_set=country_set)
+        map_by_pieces = Map(WORLD_COUNTRIES, countries_set=country_set, cache=True)
         map_by_pieces.filter_by_area(area_limit=AREA_LIMIT)
         map_by_pieces.simplify(tolerance=TOLERANCE)
         map_by_pieces.project(MERCATOR)
@@ -9,5 +9,6 @@ setup(
     author_email='danielmartinezolivas@gmail.com',
     license='MIT',
     packages=['dxfmaps'],
-    install_requires=['pyshp', 'Shapely', 'ezdxf', 'cairocffi']
+    package_data={'dxfmaps': ['fontdata/*.glyphs']},
+    install_requires=['pyshp', 'Shapely', 'ezdxf', 'cairocffi', 'numpy']
 )